@@ -0,0 +1,216 @@
+import argparse
+import ast
+import json
+import platform
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+import reaction
+import script
+import staad
+from generate_export import generate
+from report_writer import write_report
+
+DEFAULT_SIZES = "[1000, 10000, 100000]"
+
+
+def timed(timings, stage, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    timings[stage] = time.perf_counter() - start
+    return result
+
+
+def bench_script(input_path, class_1, class_2, lc, output_dir):
+    # Same steps as script.run(), timed one by one, without the cache
+    timings = {}
+    index = timed(timings, "index", staad.SectionIndex.build, input_path)
+    nodes_df = timed(timings, "parse nodes", staad.parse_nodes, index)
+    sections_df = timed(timings, "parse sections", staad.parse_sections, index)
+    beams_df = timed(timings, "parse beams", staad.parse_beams, index)
+    beam_end_forces_df = timed(
+        timings, "parse forces", staad.parse_beam_end_forces, index, lc)
+    node_to_beam_df = timed(
+        timings, "parse node to beam", staad.parse_node_to_beam, index)
+    reaction_df = timed(
+        timings, "parse reactions", staad.parse_reactions, index, lc)
+    reaction_df = timed(
+        timings, "update reactions", script.update_reaction_table,
+        sections_df, beams_df, node_to_beam_df, reaction_df)
+    joint_index = timed(
+        timings, "joint index", script.build_joint_index, beams_df, nodes_df)
+    filtered_forces_df = timed(
+        timings, "force report", script.force_report, sections_df, beams_df,
+        beam_end_forces_df, nodes_df, class_1, class_2, lc,
+        joint_index=joint_index)
+    timed(timings, "write report", write_report, {
+        "final force report": filtered_forces_df,
+        "extracted sections": sections_df,
+        "extracted beams": beams_df,
+        "extracted forces": beam_end_forces_df,
+        "extracted reactions": reaction_df,
+        "extracted nodes": nodes_df,
+    }, Path(output_dir) / "report")
+    return timings
+
+
+def table_memory(input_path):
+    # Memory of the full Beam End Forces and Reactions tables in the compact
+    # schema, against the untyped read_csv frames the tables used to be
+    index = staad.SectionIndex.build(input_path)
+    memory = {}
+    for name, header_rows, columns in (
+            ("beam_end_forces", 4, staad.BEAM_END_FORCES_COLUMNS),
+            ("reactions", 4, staad.REACTIONS_COLUMNS)):
+        untyped_df = staad.parse_table(index.lines(name)).iloc[header_rows:, 1:]
+        memory[f"{name} untyped"] = untyped_df.memory_usage(deep=True).sum()
+        for float_dtype in ("float64", "float32"):
+            parse = (staad.parse_beam_end_forces if name == "beam_end_forces"
+                     else staad.parse_reactions)
+            df = parse(index, float_dtype=float_dtype)
+            memory[f"{name} {float_dtype}"] = df.memory_usage(deep=True).sum()
+    return {key: int(value) / 1024 ** 2 for key, value in memory.items()}
+
+
+def parse_throughput(input_path):
+    # MB/s of the typed parser against the join -> StringIO -> read_csv round
+    # trip every table used to go through, on all load cases
+    index = staad.SectionIndex.build(input_path)
+    model = staad.ExportModel(input_path)
+    throughput = {}
+    for name, header_rows in (("nodes", 3), ("beams", 3), ("reactions", 4),
+                              ("beam_end_forces", 4)):
+        size_mb = len(index.read(name)) / 1024 ** 2
+        start = time.perf_counter()
+        staad.parse_table(index.lines(name)).iloc[header_rows:, 1:]
+        throughput[f"{name} read_csv"] = size_mb / (time.perf_counter() - start)
+        start = time.perf_counter()
+        model.parse(index, name)
+        throughput[f"{name} typed"] = size_mb / (time.perf_counter() - start)
+    return throughput
+
+
+def bench_reaction(input_path_1, input_path_2, lc, output_dir):
+    timings = {}
+    reaction_df_1, reaction_df_2 = timed(
+        timings, "parse", reaction.create_all_dataframes,
+        [input_path_1, input_path_2], lc, jobs=1, use_cache=False)
+    reaction_df_1, reaction_df_2, _ = timed(
+        timings, "compare", reaction.compare_reactions,
+        reaction_df_1, reaction_df_2)
+    timed(timings, "write report", write_report, {
+        "rev1": reaction_df_1,
+        "rev2": reaction_df_2,
+    }, Path(output_dir) / "reaction_report")
+    return timings
+
+
+def run(sizes, load_cases, lc, class_1, class_2, data_dir, output_path,
+        compare_path=None):
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    for size in sizes:
+        input_paths = []
+        for seed in (1, 2):
+            input_path = data_dir / f"export_{size}_{load_cases}_{seed}.csv"
+            if not input_path.exists():
+                print(f"Generating {input_path}...")
+                generate(input_path, size, load_cases, seed)
+            input_paths.append(str(input_path))
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            print(f"Benchmarking script.py with {size} beams...")
+            results.append({
+                "entry": "script", "beams": size, "load_cases": load_cases,
+                "stages": bench_script(input_paths[0], class_1, class_2, lc,
+                                       output_dir),
+            })
+            results[-1]["memory_mb"] = table_memory(input_paths[0])
+            results[-1]["throughput_mb_s"] = parse_throughput(input_paths[0])
+            print(f"Benchmarking reaction.py with {size} beams...")
+            results.append({
+                "entry": "reaction", "beams": size, "load_cases": load_cases,
+                "stages": bench_reaction(input_paths[0], input_paths[1], lc,
+                                         output_dir),
+            })
+
+    for result in results:
+        result["total"] = sum(result["stages"].values())
+
+    with open(output_path, "w") as f:
+        json.dump({
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "results": results,
+        }, f, indent=2)
+
+    summary_df = summary(results, compare_path)
+    print(summary_df.to_string(index=False))
+    memory_df = pd.DataFrame([
+        dict(r["memory_mb"], beams=r["beams"]) for r in results if "memory_mb" in r
+    ]).set_index("beams")
+    print("Table memory (MB):")
+    print(memory_df.T.to_string(float_format="%.1f"))
+    throughput_df = pd.DataFrame([
+        dict(r["throughput_mb_s"], beams=r["beams"])
+        for r in results if "throughput_mb_s" in r
+    ]).set_index("beams")
+    print("Parse throughput (MB/s):")
+    print(throughput_df.T.to_string(float_format="%.1f"))
+    print(f"Results saved to {output_path}")
+    return summary_df
+
+
+def summary(results, compare_path=None):
+    # One row per entry point, size and stage, with the ratio to an earlier
+    # run of the same stage when compare_path is given
+    rows = [
+        {"entry": r["entry"], "beams": r["beams"], "stage": stage, "seconds": seconds}
+        for r in results
+        for stage, seconds in list(r["stages"].items()) + [("total", r["total"])]
+    ]
+    summary_df = pd.DataFrame(rows)
+    if compare_path is not None:
+        with open(compare_path) as f:
+            baseline = json.load(f)["results"]
+        baseline_df = pd.DataFrame([
+            {"entry": r["entry"], "beams": r["beams"], "stage": stage, "baseline": seconds}
+            for r in baseline
+            for stage, seconds in list(r["stages"].items()) + [("total", r["total"])]
+        ])
+        summary_df = summary_df.merge(
+            baseline_df, on=["entry", "beams", "stage"], how="left")
+        summary_df["ratio"] = summary_df["seconds"] / summary_df["baseline"]
+    return summary_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=str, default=DEFAULT_SIZES,
+                        help=f"List of beam counts, e.g. '{DEFAULT_SIZES}'")
+    parser.add_argument("--load_cases", type=int, default=10,
+                        help="Number of load cases in the generated exports")
+    parser.add_argument("--lc", type=str, default="[1, 2]",
+                        help="List of load cases to report, e.g. '[1, 2]'")
+    parser.add_argument("--class_1", type=str, default="HE800A",
+                        help="First section name")
+    parser.add_argument("--class_2", type=str, default="IPE600",
+                        help="Second section name")
+    parser.add_argument("--data_dir", type=str, default="benchmark_data",
+                        help="Directory of the generated exports, reused between runs")
+    parser.add_argument("--output_path", type=str,
+                        default=f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json",
+                        help="Path of the JSON results")
+    parser.add_argument("--compare", type=str,
+                        help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+    sizes = [int(item) for item in ast.literal_eval(args.sizes)]
+    lc = [str(item) for item in ast.literal_eval(args.lc)]
+    run(sizes, args.load_cases, lc, args.class_1, args.class_2, args.data_dir,
+        args.output_path, args.compare)
@@ -0,0 +1,294 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+import shutil
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from profiling import profiler
+from staad import (GEOMETRY_TABLES, LOAD_CASE_TABLES, PARSE_STAGES, ExportModel,
+                   select_load_cases)
+
+CACHE_DIR = Path(os.environ.get(
+    "FORCEREPORT_CACHE_DIR", Path.home() / ".cache" / "forcereport"))
+CACHE_MAX_BYTES = int(os.environ.get(
+    "FORCEREPORT_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+CACHE_VERSION = 5
+# Pickles of DataFrames only load reliably with the pandas and numpy that
+# wrote them, so each version pair gets entries of its own
+LIBRARY_VERSIONS = f"pd{pd.__version__}-np{np.__version__}"
+
+HASH_INDEX = "hashes.json"
+
+
+def file_hash(input_path, cache_dir=CACHE_DIR):
+    # Content hash of the export. Hashing still reads the whole file, so the
+    # hash is remembered per path together with its size and mtime and only
+    # recomputed when either changes.
+    input_path = Path(input_path).resolve()
+    stat = input_path.stat()
+    index_path = Path(cache_dir) / HASH_INDEX
+    try:
+        with open(index_path) as f:
+            hashes = json.load(f)
+    except (OSError, ValueError):
+        hashes = {}
+
+    entry = hashes.get(str(input_path))
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["hash"]
+
+    digest = hashlib.sha256()
+    with open(input_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+
+    # Forget exports that no longer exist
+    hashes = {path: entry for path, entry in hashes.items()
+              if os.path.exists(path)}
+    hashes[str(input_path)] = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "hash": digest.hexdigest(),
+    }
+    try:
+        write_atomic(index_path, json.dumps(hashes, indent=1).encode())
+    except OSError:
+        pass
+    return digest.hexdigest()
+
+
+def write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        # Left behind when the entry was evicted during the write
+        tmp_path.unlink(missing_ok=True)
+
+
+def write_entry(path, data, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    # Adds a table to its entry and evicts others. The cache only saves
+    # time: when another process evicts the entry while it is written, the
+    # table just stays uncached.
+    try:
+        write_atomic(path, data)
+        evict(cache_dir, max_bytes, keep=path.parent)
+    except OSError:
+        pass
+
+
+def entry_size(path):
+    # 0 for an entry another process evicted meanwhile
+    try:
+        if path.is_dir():
+            return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def write_load_cases(path, df, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    # A table of every load case as one .npy file per column, rows grouped
+    # by load case. meta.json holds the span of rows of each load case, so
+    # a later run only reads the rows of the load cases it asks for, and
+    # rows.npy the row of the table each one came from.
+    codes = df["lc"].cat.codes.to_numpy()
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    categories = list(df["lc"].cat.categories)
+    category_codes = np.arange(len(categories))
+    spans = np.column_stack([
+        np.searchsorted(sorted_codes, category_codes, side="left"),
+        np.searchsorted(sorted_codes, category_codes, side="right")])
+    meta = {
+        "columns": {column: str(df[column].dtype) for column in df.columns},
+        "categories": categories,
+        "spans": spans.tolist(),
+    }
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        tmp_path.mkdir(parents=True, exist_ok=True)
+        np.save(tmp_path / "rows.npy", order)
+        for column in df.columns:
+            values = codes if column == "lc" else df[column].to_numpy()
+            np.save(tmp_path / f"{column}.npy", values[order], allow_pickle=False)
+        with open(tmp_path / "meta.json", "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+        evict(cache_dir, max_bytes, keep=path.parent)
+    except OSError:
+        # Evicted by another process meanwhile, or written by one already
+        pass
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def read_load_cases(path, lc=None):
+    # Table written by write_load_cases, of the load cases in lc or all of
+    # them. The columns are memory-mapped and only the spans of the load
+    # cases in lc are copied out, then put back in the order of the table.
+    with open(path / "meta.json") as f:
+        meta = json.load(f)
+    rows = np.load(path / "rows.npy", mmap_mode="r")
+    categories = meta["categories"]
+    if lc is None:
+        spans = [(0, len(rows))]
+    else:
+        wanted = set(lc)
+        spans = [span for label, span in zip(categories, meta["spans"])
+                 if label in wanted]
+    positions = np.concatenate([rows[start:stop] for start, stop in spans]
+                               + [np.empty(0, dtype=rows.dtype)])
+    order = np.argsort(positions, kind="stable")
+
+    columns = {}
+    for column, dtype in meta["columns"].items():
+        values = np.load(path / f"{column}.npy", mmap_mode="r")
+        values = np.concatenate([values[start:stop] for start, stop in spans]
+                                + [np.empty(0, dtype=values.dtype)])[order]
+        if dtype == "category":
+            values = pd.Categorical.from_codes(values, categories)
+            if lc is not None:
+                values = values.remove_unused_categories()
+        columns[column] = values
+    return pd.DataFrame(columns, copy=False)
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, keep=None):
+    # Drop the least recently used entries until the cache fits in max_bytes.
+    # An entry is the directory of tables of one export. keep, the entry
+    # being written, and files still being written are never dropped.
+    entries = []
+    for path in Path(cache_dir).iterdir():
+        if path.name == HASH_INDEX or path.name.endswith(".tmp"):
+            continue
+        try:
+            entries.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            continue
+    entries = [path for _, path in sorted(entries)]
+    sizes = {path: entry_size(path) for path in entries}
+    total = sum(sizes.values())
+    for path in entries:
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        total -= sizes[path]
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+
+
+class CachedExportModel(ExportModel):
+    # Each table is loaded from the cache entry of the export on first use,
+    # or parsed with every load case and added to the entry. The entry then
+    # serves any --lc, only reading the rows of those load cases, and an
+    # entry point never touches the tables it does not use.
+    def __init__(self, input_path, lc=None, float_dtype="float64",
+                 rebuild_cache=False, cache_dir=CACHE_DIR,
+                 max_bytes=CACHE_MAX_BYTES):
+        super().__init__(input_path, lc, float_dtype)
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        with profiler.stage("Hashing input"):
+            key = file_hash(input_path, self.cache_dir)
+        self.cache_path = self.cache_dir / f"{key}-v{CACHE_VERSION}-{LIBRARY_VERSIONS}-{float_dtype}"
+        if rebuild_cache:
+            shutil.rmtree(self.cache_path, ignore_errors=True)
+
+    def load(self, name):
+        if name in LOAD_CASE_TABLES:
+            return self.load_load_cases(name)
+
+        table_path = self.cache_path / f"{name}.pkl"
+        df = None
+        if table_path.exists():
+            with profiler.stage(f"Loading {name} from cache"):
+                try:
+                    with open(table_path, "rb") as f:
+                        df = pickle.load(f)
+                    # Mark the entry as recently used for eviction
+                    os.utime(self.cache_path)
+                # A damaged or foreign pickle can fail in any way
+                except Exception:
+                    df = None
+
+        if df is None:
+            index = self.index
+            with profiler.stage(PARSE_STAGES[name]):
+                df = self.parse(index, name)
+            with profiler.stage("Writing cache"):
+                write_entry(table_path, pickle.dumps(
+                    df, protocol=pickle.HIGHEST_PROTOCOL), self.cache_dir, self.max_bytes)
+        return df
+
+    def load_load_cases(self, name):
+        table_path = self.cache_path / name
+        if table_path.exists():
+            with profiler.stage(f"Loading {name} from cache"):
+                try:
+                    df = read_load_cases(table_path, self.lc)
+                    os.utime(self.cache_path)
+                    return df
+                except Exception:
+                    pass
+
+        index = self.index
+        with profiler.stage(PARSE_STAGES[name]):
+            df = self.parse(index, name)
+        with profiler.stage("Writing cache"):
+            write_load_cases(table_path, df, self.cache_dir, self.max_bytes)
+        if self.lc is not None:
+            with profiler.stage("Selecting load cases"):
+                df = select_load_cases(df, self.lc)
+        return df
+
+
+def load_export(input_path, lc=None, use_cache=True, rebuild_cache=False,
+                float_dtype="float64", cache_dir=CACHE_DIR,
+                max_bytes=CACHE_MAX_BYTES):
+    # Lazily parsed tables of the export, restricted to the load cases in lc
+    if not use_cache:
+        return ExportModel(input_path, lc, float_dtype)
+    return CachedExportModel(input_path, lc, float_dtype, rebuild_cache,
+                             cache_dir, max_bytes)
+
+
+def load_derived(model, name, compute, use_cache=True, rebuild_cache=False,
+                 cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES,
+                 tables=GEOMETRY_TABLES):
+    # Result of compute() for a result that only depends on the nodes, beams
+    # and sections of the model, or on the tables given. It is cached under
+    # the hash of those tables, so a revision that only changes loads reuses
+    # a result of the geometry.
+    if not use_cache:
+        return compute()
+
+    cache_dir = Path(cache_dir)
+    key = model.content_hash(tables)
+    prefix = "geometry" if list(tables) == GEOMETRY_TABLES else "-".join(tables)
+    entry_path = cache_dir / f"{prefix}-{key}-v{CACHE_VERSION}-{LIBRARY_VERSIONS}"
+    path = entry_path / (re.sub(r"[^\w\-.]", "_", name) + ".pkl")
+    if not rebuild_cache and path.exists():
+        with profiler.stage(f"Loading {name} from cache"):
+            try:
+                with open(path, "rb") as f:
+                    result = pickle.load(f)
+                os.utime(entry_path)
+                return result
+            except Exception:
+                pass
+
+    result = compute()
+    with profiler.stage("Writing cache"):
+        write_entry(path, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL),
+                    cache_dir, max_bytes)
+    return result
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+from staad import FORCE_COLUMNS
+
+ENVELOPE_COLUMNS = ["force", "max", "max_lc", "min", "min_lc", "abs_max", "abs_max_lc"]
+
+
+def envelope(df, by, columns=FORCE_COLUMNS):
+    # Max, min and largest magnitude of each force over the load cases of
+    # each group of rows, with the load case it comes from. One row per
+    # group and force, abs_max keeps its sign. Rows are sorted by group once
+    # and every force is reduced over the sorted groups.
+    if len(df) == 0:
+        return pd.DataFrame(columns=list(by) + ENVELOPE_COLUMNS)
+
+    # Step 1: sort the rows by group
+    codes = df.groupby(by, sort=True, dropna=False, observed=True).ngroup().to_numpy()
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    counts = np.diff(np.r_[starts, len(codes)])
+    groups_df = df[by].iloc[order[starts]].reset_index(drop=True)
+
+    # Step 2: the first row of each group reaching the peak of each force
+    lc = df["lc"].astype("category")
+    lc_codes = lc.cat.codes.to_numpy()[order]
+    values = {}
+    rows = {}
+    for column in columns:
+        forces = df[column].to_numpy(dtype=np.float64)[order]
+        for name, key in (("max", forces), ("min", -forces),
+                          ("abs_max", np.abs(forces))):
+            peak = np.fmax.reduceat(key, starts)
+            hits = np.flatnonzero(key == np.repeat(peak, counts))
+            first = np.r_[True, codes[hits[1:]] != codes[hits[:-1]]]
+            row = np.full(len(starts), -1)
+            row[codes[hits[first]]] = hits[first]
+            # Groups without any value have no governing row
+            values[(column, name)] = np.where(row >= 0, forces[row], np.nan)
+            rows[(column, name)] = np.where(row >= 0, lc_codes[row], -1)
+
+    # Step 3: one row per group and force
+    envelope_df = groups_df.iloc[np.repeat(np.arange(len(starts)), len(columns))]
+    envelope_df = envelope_df.reset_index(drop=True)
+    envelope_df["force"] = np.tile(columns, len(starts))
+    for name in ("max", "min", "abs_max"):
+        envelope_df[name] = np.column_stack(
+            [values[(column, name)] for column in columns]).ravel()
+        envelope_df[f"{name}_lc"] = pd.Categorical.from_codes(
+            np.column_stack([rows[(column, name)] for column in columns]).ravel(),
+            dtype=lc.dtype)
+    return envelope_df
@@ -0,0 +1,108 @@
+import argparse
+import random
+from staad import ENCODING, PREAMBLE_LINES
+
+SECTIONS = [
+    (1, "HE800A", 286.0, 303400.0, 12640.0, 597.0),
+    (2, "HE800A", 286.0, 303400.0, 12640.0, 597.0),
+    (3, "IPE600", 156.0, 92080.0, 3387.0, 165.0),
+]
+# Columns, beams along x and beams along z
+DIRECTION_PROPERTY = {(0, 1, 0): 1, (1, 0, 0): 2, (0, 0, 1): 3}
+
+BAY_X = 6.0
+BAY_Z = 8.0
+STOREY = 4.5
+
+
+def grid_size(beams):
+    # Smallest n x n x n node grid with at least the requested number of beams
+    size = 2
+    while 3 * size * size * (size - 1) < beams:
+        size += 1
+    return size
+
+
+def generate(path, beams=1000, load_cases=10, seed=1):
+    # Write a STAAD.Pro style export of a regular frame with the requested
+    # number of beams, in the layout staad.py parses
+    rnd = random.Random(seed)
+    size = grid_size(beams)
+    lcs = list(range(1, load_cases + 1))
+
+    def node_id(i, j, k):
+        return 1 + i + j * size + k * size * size
+
+    def forces():
+        return ",".join(f"{rnd.uniform(-500, 500):.3f}" for _ in range(6))
+
+    beam_list = []
+    for k in range(size):
+        for j in range(size):
+            for i in range(size):
+                for (di, dj, dk), property_id in DIRECTION_PROPERTY.items():
+                    if i + di < size and j + dj < size and k + dk < size:
+                        beam_list.append((
+                            len(beam_list) + 1, node_id(i, j, k),
+                            node_id(i + di, j + dj, k + dk), property_id,
+                            BAY_X if di else STOREY if dj else BAY_Z))
+    beam_list = beam_list[:beams]
+    supports = [node_id(i, 0, k) for k in range(size) for i in range(size)]
+
+    with open(path, "w", encoding=ENCODING, newline="\r\n") as f:
+        f.write("STAAD.Pro CONNECT Edition,,,,,,,,,\n")
+        for i in range(1, PREAMBLE_LINES):
+            f.write(f"Synthetic export line {i},,,,,,,,,\n")
+
+        f.write("Nodes,,,,\n,Node,X,Y,Z\n,,m,m,m\n")
+        for k in range(size):
+            for j in range(size):
+                for i in range(size):
+                    f.write(f",{node_id(i, j, k)},{i * BAY_X:g},{j * STOREY:g},{k * BAY_Z:g}\n")
+
+        f.write("\nBeams,,,,,,\n,Beam,Node A,Node B,Length,Property,Beta\n,,,,m,,degrees\n")
+        for beam_id, node_a, node_b, property_id, length in beam_list:
+            f.write(f",{beam_id},{node_a},{node_b},{length:g},{property_id},0\n")
+
+        f.write("\nSections,,,,,,,,\n,Prop,Section,Area,Iyy,Izz,J,Material,Source\n"
+                ",,,cm2,cm4,cm4,cm4,,\n")
+        for property_id, name, area, iyy, izz, j in SECTIONS:
+            f.write(f",{property_id},{name},{area:g},{iyy:g},{izz:g},{j:g},STEEL,EURO\n")
+
+        f.write("\nSupports,,,\n,Node,Type,\n")
+        for node in supports:
+            f.write(f",{node},Fixed,\n")
+
+        f.write("\nReactions,,,,,,,,\n,,,Horizontal,Vertical,Horizontal,Moment,,\n"
+                ",Node,L/C,Fx,Fy,Fz,Mx,My,Mz\n,,,kN,kN,kN,kNm,kNm,kNm\n")
+        for node in supports:
+            for i, lc in enumerate(lcs):
+                f.write(f",{node if i == 0 else ''},{lc},{forces()}\n")
+
+        f.write("\nBeam End Forces,,,,,,,,,\n,,,,Axial,Shear,,Torsion,Bending,\n"
+                ",Beam,Node,L/C,Fx,Fy,Fz,Mx,My,Mz\n,,,,kN,kN,kN,kNm,kNm,kNm\n")
+        for beam_id, node_a, node_b, _, _ in beam_list:
+            first = True
+            for lc in lcs:
+                for node in (node_a, node_b):
+                    f.write(f",{beam_id if first else ''},{node},{lc},{forces()}\n")
+                    first = False
+
+        f.write("\nMax Forces by Property,,,,,,,,,\n,Property,,,,,,,,\n")
+
+    return len(beam_list)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output_path", required=True,
+                        type=str, help="Path of the generated export")
+    parser.add_argument("--beams", type=int, default=1000,
+                        help="Number of beams")
+    parser.add_argument("--load_cases", type=int, default=10,
+                        help="Number of load cases, numbered from 1")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="Seed of the random forces, change it to get another revision")
+    args = parser.parse_args()
+    beam_count = generate(args.output_path, args.beams, args.load_cases, args.seed)
+    print(f"Wrote {beam_count} beams to {args.output_path}")
@@ -0,0 +1,92 @@
+import itertools
+import numpy as np
+import pandas as pd
+
+# Cells that can hold a match, as steps towards the closer side of the
+# cell of the query along each axis
+NEIGHBOUR_OFFSETS = np.array(list(itertools.product((0, 1), repeat=3)))
+
+
+def cell_keys(cells, origin, dims):
+    cells = cells - origin
+    return (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+
+def nearest_within(points, queries, tolerance):
+    # Index of the nearest point whose coordinates are all within tolerance
+    # of each query, -1 when there is none. Points are hashed into a grid of
+    # cells twice the tolerance wide, so a match is in the cell of the query
+    # or a neighbour on the closer side of each axis, and a query only looks
+    # at the points of 8 cells.
+    match = np.full(len(queries), -1)
+    best = np.full(len(queries), np.inf)
+    point_known = np.isfinite(points).all(axis=1)
+    query_known = np.isfinite(queries).all(axis=1)
+    if not point_known.any() or not query_known.any():
+        return match
+
+    point_ids = np.flatnonzero(point_known)
+    query_ids = np.flatnonzero(query_known)
+    cell_size = 2 * tolerance
+    point_cells = np.floor(points[point_ids] / cell_size).astype(np.int64)
+    query_position = queries[query_ids] / cell_size
+    query_cells = np.floor(query_position).astype(np.int64)
+    direction = np.where(query_position - query_cells < 0.5, -1, 1)
+    origin = np.minimum(point_cells.min(axis=0), query_cells.min(axis=0)) - 1
+    dims = np.maximum(point_cells.max(axis=0), query_cells.max(axis=0)) - origin + 2
+
+    # Points sorted by cell, with the first point and point count of each
+    # cell found through a hash table of the cells
+    point_keys = cell_keys(point_cells, origin, dims)
+    order = np.argsort(point_keys, kind="stable")
+    cells, starts, counts = np.unique(
+        point_keys[order], return_index=True, return_counts=True)
+    cell_index = pd.Index(cells)
+    for offset in NEIGHBOUR_OFFSETS:
+        keys = cell_keys(query_cells + offset * direction, origin, dims)
+        found = cell_index.get_indexer(keys)
+        lo = np.where(found >= 0, starts[found], 0)
+        hi = np.where(found >= 0, lo + counts[found], 0)
+        # Walk the points of each cell, one at a time for all queries
+        k = 0
+        while True:
+            q = np.flatnonzero(lo + k < hi)
+            if len(q) == 0:
+                break
+            p = point_ids[order[lo[q] + k]]
+            distance = np.abs(points[p] - queries[query_ids[q]]).max(axis=1)
+            better = (distance <= tolerance) & (distance < best[query_ids[q]])
+            match[query_ids[q[better]]] = p[better]
+            best[query_ids[q[better]]] = distance[better]
+            k += 1
+    return match
+
+
+def match_nodes(node_dfs, tolerance):
+    # Pair the nodes (node, x, y, z rows) of several revisions by their
+    # coordinates. Returns one array per revision with the key of each of
+    # its nodes, equal for nodes at the same place, and the node table
+    # of every key with the node id of each revision (NA when missing).
+    # Keys are given to the nodes of the first revision, then to the nodes
+    # of later revisions that match none of the nodes before them.
+    coordinates = np.empty((0, 3))
+    node_keys = []
+    for df in node_dfs:
+        queries = df[["x", "y", "z"]].to_numpy(dtype=float)
+        keys = nearest_within(coordinates, queries, tolerance)
+        # A node already matched by another node of the same revision
+        # becomes a node of its own
+        taken = pd.Series(keys).duplicated().to_numpy() & (keys >= 0)
+        keys[taken] = -1
+
+        new = keys < 0
+        keys[new] = len(coordinates) + np.arange(np.count_nonzero(new))
+        coordinates = np.concatenate([coordinates, queries[new]])
+        node_keys.append(keys)
+
+    matches_df = pd.DataFrame(coordinates, columns=["x", "y", "z"])
+    for i, (df, keys) in enumerate(zip(node_dfs, node_keys)):
+        node_ids = pd.array([pd.NA] * len(coordinates), dtype="Int64")
+        node_ids[keys] = df["node"].to_numpy()
+        matches_df[i] = node_ids
+    return node_keys, matches_df
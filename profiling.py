@@ -0,0 +1,121 @@
+import cProfile
+import json
+import sys
+import time
+from contextlib import contextmanager
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is then reported as missing
+    resource = None
+
+
+def reset_peak_rss():
+    # Linux can reset the peak RSS of the process, which makes the peak
+    # measured after a stage that stage's own peak
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.use_cprofile = False
+        self.records = []
+        self.cprofiles = {}
+        # Stages entered and not left yet
+        self.depth = 0
+
+    def enable(self, use_cprofile=False):
+        self.enabled = True
+        self.use_cprofile = use_cprofile
+
+    @contextmanager
+    def stage(self, name):
+        # Prints the progress line of the stage and, when enabled, records
+        # its wall time, CPU time and peak RSS. A stage inside another one
+        # is recorded as nested: it neither resets the peak RSS nor starts
+        # a cProfile of its own, only one can be active at a time.
+        print(f"{name}...")
+        if not self.enabled:
+            yield
+            return
+
+        nested = self.depth > 0
+        if not nested:
+            reset_peak_rss()
+        profile = cProfile.Profile() if self.use_cprofile and not nested else None
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profile is not None:
+            profile.enable()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            if profile is not None:
+                profile.disable()
+            record = {
+                "stage": name,
+                "wall_s": time.perf_counter() - wall_start,
+                "cpu_s": time.process_time() - cpu_start,
+                "peak_rss_mb": peak_rss_mb(),
+            }
+            if nested:
+                record["nested"] = True
+            self.records.append(record)
+            if profile is not None:
+                self.cprofiles[len(self.records) - 1] = profile
+
+    def summary(self):
+        summary_df = pd.DataFrame(
+            self.records, columns=["stage", "wall_s", "cpu_s", "peak_rss_mb"])
+        # Stages that ran in worker processes overlap with the parent stage
+        # that waited for them, nested stages with the stage around them,
+        # both are left out of the total
+        own = [not record.get("worker") and not record.get("nested")
+               for record in self.records]
+        total = pd.DataFrame([{
+            "stage": "total",
+            "wall_s": summary_df["wall_s"][own].sum(),
+            "cpu_s": summary_df["cpu_s"][own].sum(),
+            "peak_rss_mb": summary_df["peak_rss_mb"][own].max(),
+        }])
+        return pd.concat([summary_df, total], ignore_index=True)
+
+    def report(self, json_path, cprofile_path=None):
+        print(self.summary().to_string(index=False, float_format="%.3f"))
+        with open(json_path, "w") as f:
+            json.dump({"argv": sys.argv, "stages": self.records}, f, indent=2)
+        print(f"Profile saved to {json_path}")
+
+        if cprofile_path and self.cprofiles:
+            hottest = max(self.cprofiles,
+                          key=lambda i: self.records[i]["wall_s"])
+            self.cprofiles[hottest].dump_stats(cprofile_path)
+            print(f"cProfile stats of '{self.records[hottest]['stage']}' "
+                  f"saved to {cprofile_path}")
+
+
+profiler = Profiler()
@@ -0,0 +1,240 @@
+import server
+
+if __name__ == "__main__":
+    server.forward("query", local_flags=["--interactive"])
+
+import argparse
+import ast
+import sys
+import time
+import numpy as np
+from functools import partial
+from cache import load_derived
+
+# Words of an interactive query, each followed by its values
+QUERY_KEYS = ["node", "beam", "property", "lc"]
+QUERY_VALUES = {"node": "an id", "beam": "an id", "property": "a name",
+                "lc": "a load case"}
+
+
+def group_index(keys, rows=None):
+    # Rows of a table with each key, as the row positions sorted by key and
+    # the (start, stop) span of each key in them. rows are the row positions
+    # of keys, their index when None. A plain tuple, the cache can then load
+    # it from any entry point.
+    keys = np.asarray(keys)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    stops = np.r_[starts[1:], len(keys)].astype(starts.dtype)
+    if rows is not None:
+        order = np.asarray(rows)[order]
+    if len(keys) == 0:
+        return order, {}
+    return order, dict(zip(sorted_keys[starts].tolist(),
+                           zip(starts.tolist(), stops.tolist())))
+
+
+def lookup(index, key):
+    order, spans = index
+    start, stop = spans.get(key, (0, 0))
+    return order[start:stop]
+
+
+def select(df, rows, lc=None, node=None):
+    # Rows of df at the positions in rows, of the load cases in lc and of
+    # the node, filtered on the positions before the rows are taken
+    if node is not None:
+        rows = rows[df["node"].to_numpy()[rows] == node]
+    if lc is not None:
+        lc_column = df["lc"].array
+        wanted = lc_column.categories.get_indexer(lc)
+        rows = rows[np.isin(lc_column.codes[rows], wanted[wanted >= 0])]
+    return df.iloc[rows]
+
+
+class ModelIndex:
+    # Hash indexes over the tables of a model: the beams at each node, of
+    # each beam id and of each property, the forces of each beam and load
+    # case and the reactions of each node. Each is built once and cached
+    # under the hash of the tables it indexes.
+    def __init__(self, tables, use_cache=True, rebuild_cache=False):
+        self.tables = tables
+        derived = partial(load_derived, tables, use_cache=use_cache,
+                          rebuild_cache=rebuild_cache)
+        beams_df = tables["beams"]
+        sections_df = tables["sections"]
+        forces_df = tables["beam_end_forces"]
+        reactions_df = tables["reactions"]
+
+        self.beams_df = beams_df.merge(
+            sections_df[["property_id", "name"]].drop_duplicates(subset=["property_id"])
+            .rename(columns={"name": "property_name"}),
+            on="property_id", how="left")
+        self.node_beams = derived("query node beams", lambda: group_index(
+            np.concatenate([beams_df["node_a"], beams_df["node_b"]]),
+            np.tile(np.arange(len(beams_df)), 2)))
+        self.beam_rows = derived("query beam rows", lambda: group_index(
+            beams_df["beam_id"]))
+        self.property_beams = derived("query property beams", lambda: group_index(
+            self.beams_df["property_name"].fillna("").astype(str)))
+        self.force_beams = derived("query force beams", lambda: group_index(
+            forces_df["beam_id"]), tables=["beam_end_forces"])
+        self.force_load_cases = derived("query force load cases", lambda: group_index(
+            forces_df["lc"].astype(str)), tables=["beam_end_forces"])
+        self.reaction_nodes = derived("query reaction nodes", lambda: group_index(
+            reactions_df["node"]), tables=["reactions"])
+
+    def beams(self, rows):
+        return self.beams_df.iloc[np.sort(rows)]
+
+    def forces(self, rows, lc=None, node=None):
+        return select(self.tables["beam_end_forces"], rows, lc, node)
+
+    def node(self, node, lc=None):
+        # Beams meeting at the node, their end forces at it and its reactions
+        beam_rows = np.sort(lookup(self.node_beams, node))
+        beams_df = self.beams_df.iloc[beam_rows]
+        forces_df = self.forces(np.concatenate(
+            [lookup(self.force_beams, beam_id)
+             for beam_id in self.beams_df["beam_id"].to_numpy()[beam_rows].tolist()]
+            + [np.empty(0, dtype=np.int64)]), lc, node)
+        reactions_df = select(self.tables["reactions"],
+                              lookup(self.reaction_nodes, node), lc)
+        return {f"beams at node {node}": beams_df,
+                f"end forces at node {node}": forces_df,
+                f"reactions of node {node}": reactions_df}
+
+    def beam(self, beam_id, lc=None):
+        return {f"beam {beam_id}": self.beams(lookup(self.beam_rows, beam_id)),
+                f"end forces of beam {beam_id}": self.forces(
+                    lookup(self.force_beams, beam_id), lc)}
+
+    def property(self, property_name):
+        return {f"beams of {property_name}": self.beams(
+            lookup(self.property_beams, property_name))}
+
+    def load_cases(self, lc):
+        return {f"forces of load cases {', '.join(lc)}": self.forces(np.sort(np.concatenate(
+            [lookup(self.force_load_cases, item) for item in lc]
+            + [np.empty(0, dtype=np.int64)])))}
+
+    def query(self, node=None, beam=None, property_name=None, lc=None):
+        if node is not None:
+            return self.node(node, lc)
+        if beam is not None:
+            return self.beam(beam, lc)
+        if property_name is not None:
+            return self.property(property_name)
+        return self.load_cases(lc)
+
+
+def parse_query(line):
+    # "node 1234 lc 203 204" -> keyword arguments of ModelIndex.query
+    values = {}
+    key = None
+    for token in line.split():
+        if token in QUERY_KEYS:
+            key = token
+            values[key] = []
+        elif key is None:
+            raise ValueError(f"A query starts with one of {', '.join(QUERY_KEYS)}")
+        else:
+            values[key].append(token)
+    for key, items in values.items():
+        if not items:
+            raise ValueError(f"{key} needs {QUERY_VALUES[key]}")
+    if "property" in values and "lc" in values:
+        raise ValueError("The beams of a property have no load cases, drop lc")
+    query = {}
+    if "node" in values:
+        query["node"] = int(values["node"][0])
+    if "beam" in values:
+        query["beam"] = int(values["beam"][0])
+    if "property" in values:
+        query["property_name"] = " ".join(values["property"])
+    if "lc" in values:
+        query["lc"] = values["lc"]
+    if not query:
+        raise ValueError("Nothing to look up")
+    return query
+
+
+def print_answer(answer, elapsed, limit):
+    for title, df in answer.items():
+        print(f"{title}: {len(df)} rows")
+        if len(df):
+            print(df.head(limit).to_string(index=False))
+            if len(df) > limit:
+                print(f"... {len(df) - limit} more rows")
+    print(f"({elapsed * 1000:.3f} ms)")
+
+
+def interactive(index, limit):
+    print("Queries like 'node 1234 lc 203', 'beam 12', 'property HE800A' or 'lc 101 102', "
+          "an empty line quits")
+    for line in sys.stdin:
+        if not line.strip():
+            break
+        try:
+            query = parse_query(line)
+        except ValueError as e:
+            print(e)
+            continue
+        start = time.perf_counter()
+        answer = index.query(**query)
+        print_answer(answer, time.perf_counter() - start, limit)
+
+
+def main(argv=None, store=None):
+    parser = argparse.ArgumentParser(prog="query.py")
+    parser.add_argument("--input_path", required=True,
+                        type=str, help="Path of the input file")
+    parser.add_argument("--node", type=int, help="Beams, end forces and reactions of a node")
+    parser.add_argument("--beam", type=int, help="End forces of a beam")
+    parser.add_argument("--property", type=str, help="Beams of a section property")
+    parser.add_argument("--lc", type=str,
+                        help="List of load cases, e.g. '[1, 2, 203]', alone it lists their forces")
+    parser.add_argument("--interactive", action="store_true",
+                        help="Read queries from the standard input, e.g. 'node 1234 lc 203'")
+    parser.add_argument("--limit", type=int, default=100,
+                        help="Rows printed per table")
+    parser.add_argument("--no_cache", "--no-cache", action="store_true",
+                        help="Parse the input without reading or writing the cache")
+    parser.add_argument("--rebuild_cache", "--rebuild-cache", action="store_true",
+                        help="Parse the input again and replace its cache entry")
+    parser.add_argument("--float32", action="store_true",
+                        help="Keep forces and moments as float32 to halve their memory")
+    parser.add_argument("--no_server", "--no-server", action="store_true",
+                        help="Run in this process even when server.py is running")
+    argv = sys.argv[1:] if argv is None else argv
+    args = parser.parse_args(argv)
+    if args.node is None and args.beam is None and args.property is None \
+            and args.lc is None and not args.interactive:
+        parser.error("one of --node, --beam, --property, --lc or --interactive is required")
+    if args.property is not None and args.lc is not None:
+        parser.error("--lc does not apply to --property, its beams have no load cases")
+    lc = [str(item) for item in ast.literal_eval(args.lc)] if args.lc else None
+    float_dtype = "float32" if args.float32 else "float64"
+    use_cache = not args.no_cache
+    # Every load case is indexed, lc is only applied to the answers
+    tables = server.load_tables(args.input_path, None, float_dtype, use_cache,
+                                args.rebuild_cache, store)
+    if store is None:
+        index = ModelIndex(tables, use_cache, args.rebuild_cache)
+    else:
+        # Kept with the model until the server drops it
+        if getattr(tables.model, "query_index", None) is None:
+            tables.model.query_index = ModelIndex(tables, use_cache, args.rebuild_cache)
+        index = tables.model.query_index
+
+    if args.interactive:
+        interactive(index, args.limit)
+        return
+    start = time.perf_counter()
+    answer = index.query(args.node, args.beam, args.property, lc)
+    print_answer(answer, time.perf_counter() - start, args.limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,26 @@
+import server
+
+if __name__ == "__main__":
+    server.forward("reaction")
+
+import numpy as np
 import pandas as pd
 import argparse
 import ast
-from io import StringIO
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
+from cache import load_derived
+from node_matching import match_nodes
+from profiling import profiler
+from report_writer import FORMATS, widen_float32, write_report
+from staad import CHUNK_ROWS
+from script import ERROR_OFFSET, node_properties
 
-
-def extract_table(lines, start_keyword, next_keywords):
-    start = None
-    end = None
-    for i, line in enumerate(lines):
-        if start is None and start_keyword in line:
-            start = i
-        elif start is not None and any(k in line for k in next_keywords):
-            end = i
-            break
-    return lines[start:end] if start is not None else []
-
-
-def parse_table(table_lines, dtype=None):
-    table_str = "\n".join(table_lines)
-    if dtype is not None:
-        df = pd.read_csv(StringIO(table_str), header=None, dtype=dtype)
-    else:
-        df = pd.read_csv(StringIO(table_str), header=None, low_memory=False)
-    df = df.dropna(how='all', axis=0).dropna(how='all', axis=1)
-    return df
+# Reaction components compared between revisions
+COMPARE_COLUMNS = ['fx', 'fy', 'fz']
 
 
 def get_intersection(set_1, set_2):
@@ -35,157 +30,433 @@ def get_intersection(set_1, set_2):
     return None
 
 
-def update_reaction_table(sections_df, beams_df, beam_end_forces_df, reaction_df):
-    # Step 1: Get the first beam_id for each node from beam_end_forces_df
-    node_to_beam = beam_end_forces_df.drop_duplicates(
-        subset=['node'], keep='first')[['node', 'beam_id']]
-
-    # Step 2: Merge reaction_df with node_to_beam to get beam_id
-    reaction_df = reaction_df.merge(node_to_beam, on='node', how='left')
-
-    # Step 3: Merge with beams_df to get property_id
-    reaction_df = reaction_df.merge(
-        beams_df[['beam_id', 'property_id']], on='beam_id', how='left')
-
-    # Step 4: Merge with sections_df to get property_name
-    reaction_df = reaction_df.merge(
-        sections_df[['property_id', 'name']], on='property_id', how='left')
-
-    # Step 5: Rename the 'name' column to 'property_name'
-    reaction_df = reaction_df.rename(columns={'name': 'property_name'})
-
-    return reaction_df
+def create_dataframes(input_path, lc, use_cache=True, rebuild_cache=False,
+                      float_dtype="float64", coordinates=False, store=None,
+                      stream_rows=None):
+    # With coordinates the x, y, z of each node are added, which also
+    # parses the nodes table. store is the server.ModelStore of the models
+    # kept in memory by the server, when running there. With stream_rows
+    # the reactions are read stream_rows rows at a time.
+    tables = server.load_tables(input_path, lc, float_dtype, use_cache,
+                                rebuild_cache, store)
+    # The property of each node only depends on the geometry, and is reused
+    # from the cache for revisions that only change loads
+    node_properties_df = load_derived(
+        tables, "node properties",
+        lambda: node_properties(
+            tables["sections"], tables["beams"], tables["node_to_beam"]),
+        use_cache=use_cache, rebuild_cache=rebuild_cache)
+    if stream_rows is not None and store is None:
+        reaction_df = tables.stream("reactions", chunk_rows=stream_rows)
+    else:
+        reaction_df = tables["reactions"]
+    nodes_df = tables["nodes"] if coordinates else None
 
+    with profiler.stage("Updating reactions"):
+        reaction_df = reaction_df.merge(node_properties_df, on='node', how='left')
+        if nodes_df is not None:
+            reaction_df = reaction_df.merge(
+                nodes_df[['node', 'x', 'y', 'z']].drop_duplicates(subset=['node']),
+                on='node', how='left')
 
-def create_dataframes(input_path, lc):
-    # Load CSV lines, skipping the first 30 lines
-    with open(input_path, encoding="iso-8859-1") as f:
-        lines = f.readlines()[30:]
-
-    # Extract tables
-    nodes_lines = extract_table(lines, "Nodes", ["Beams"])
-    beams_lines = extract_table(lines, "Beams", ["Supports", "Sections"])
-    sections_lines = extract_table(
-        lines, "Sections", ["Supports",  "STAAD.Pro"])
-    reaction_lines = extract_table(
-        lines, "Reactions", ["Beam End Forces"])
-    beam_end_forces_lines = extract_table(
-        lines, "Beam End Forces", ["Max Forces by Property"])
-
-    # Parse to DataFrames
-    print("Parsing nodes...")
-    nodes_df = parse_table(nodes_lines)
-    nodes_df = nodes_df.iloc[3:, 1:].reset_index(drop=True)
-    nodes_df.columns = ["node", "x", "y", "z"]
-    nodes_df['node'] = nodes_df['node'].astype(int)
-
-    print("Parsing sections...")
-    sections_df = parse_table(sections_lines)
-    sections_df = sections_df.iloc[3:, 1:].reset_index(drop=True)
-    sections_df.columns = ["property_id", "name",
-                           "area", "iyy", "izz", "j", "material", "source"]
-    sections_df['property_id'] = sections_df['property_id'].astype(int)
-
-    print("Parsing beams...")
-    beams_df = parse_table(beams_lines)
-    beams_df = beams_df.iloc[3:, 1:].reset_index(drop=True)
-    beams_df.columns = ["beam_id", "node_a",
-                        "node_b", "len", "property_id", "beta"]
-    beams_df['beam_id'] = beams_df['beam_id'].astype(int)
-    beams_df['node_a'] = beams_df['node_a'].astype(int)
-    beams_df['node_b'] = beams_df['node_b'].astype(int)
-    beams_df['property_id'] = beams_df['property_id'].astype(int)
-
-    print("Parsing forces...")
-    beam_end_forces_df = parse_table(beam_end_forces_lines)
-    beam_end_forces_df = beam_end_forces_df.iloc[4:, 1:].reset_index(drop=True)
-    beam_end_forces_df.columns = [
-        "beam_id", "node", "lc", "fx", "fy", "fz", "mx", "my", "mz"]
-    beam_end_forces_df['beam_id'] = beam_end_forces_df['beam_id'].ffill()
-    beam_end_forces_df['beam_id'] = beam_end_forces_df['beam_id'].astype(int)
-    beam_end_forces_df['node'] = beam_end_forces_df['node'].astype(int)
-
-    print("Parsing reactions...")
-    reaction_df = parse_table(reaction_lines)
-    reaction_df = reaction_df.iloc[4:, 1:].reset_index(drop=True)
-    reaction_df.columns = ["node", "lc", "fx", "fy", "fz", "mx", "my", "mz"]
-    reaction_df['node'] = reaction_df['node'].ffill()
-    reaction_df['node'] = reaction_df['node'].astype(int)
-    reaction_df['fx'] = reaction_df['fx'].astype(float)
-    reaction_df['fy'] = reaction_df['fy'].astype(float)
-    reaction_df['fz'] = reaction_df['fz'].astype(float)
-
-    reaction_df = update_reaction_table(
-        sections_df, beams_df, beam_end_forces_df, reaction_df)
-
-    reaction_df = reaction_df[reaction_df["lc"].isin(lc)]
-    reaction_df = reaction_df.sort_values(by='property_name', ascending=False)
+        reaction_df = reaction_df.sort_values(
+            by='property_name', ascending=False)
 
     return reaction_df
 
 
-def compare_reactions(reaction_df_1, reaction_df_2):
-    df_1_result = reaction_df_1.copy()
-    df_2_result = reaction_df_2.copy()
-
-    # For df_1: merge with df_2 to get corresponding values
-    df_1_merged = df_1_result.merge(
-        reaction_df_2[['node', 'lc', 'fx', 'fy', 'fz']],
-        on=['node', 'lc'],
-        how='left',
-        suffixes=('', '_df2')
-    )
-
-    # Calculate differences for df_1
-    df_1_merged['fx1-fx2'] = df_1_merged['fx'] - df_1_merged['fx_df2']
-    df_1_merged['fy1-fy2'] = df_1_merged['fy'] - df_1_merged['fy_df2']
-    df_1_merged['fz1-fz2'] = df_1_merged['fz'] - df_1_merged['fz_df2']
-
-    # Remove temporary columns and keep only original columns + difference columns
-    df_1_result = df_1_merged.drop(['fx_df2', 'fy_df2', 'fz_df2'], axis=1)
-
-    # For df_2: merge with df_1 to get corresponding values
-    df_2_merged = df_2_result.merge(
-        reaction_df_1[['node', 'lc', 'fx', 'fy', 'fz']],
-        on=['node', 'lc'],
-        how='left',
-        suffixes=('', '_df1')
-    )
-
-    # Calculate differences for df_2
-    df_2_merged['fx2-fx1'] = df_2_merged['fx'] - df_2_merged['fx_df1']
-    df_2_merged['fy2-fy1'] = df_2_merged['fy'] - df_2_merged['fy_df1']
-    df_2_merged['fz2-fz1'] = df_2_merged['fz'] - df_2_merged['fz_df1']
-
-    # Remove temporary columns
-    df_2_result = df_2_merged.drop(['fx_df1', 'fy_df1', 'fz_df1'], axis=1)
-
-    return df_1_result, df_2_result
-
-
-def run(input_path_1, input_path_2, lc):
-    reaction_df_1 = create_dataframes(input_path_1, lc)
-    reaction_df_2 = create_dataframes(input_path_2, lc)
-    reaction_df_1, reaction_df_2 = compare_reactions(
-        reaction_df_1, reaction_df_2)
-
-    with pd.ExcelWriter("reaction_report.xlsx", engine='xlsxwriter') as writer:
-        reaction_df_1.to_excel(
-            writer, sheet_name=Path(input_path_1).stem, index=False)
-        reaction_df_2.to_excel(
-            writer, sheet_name=Path(input_path_2).stem, index=False)
-
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--input_path_1", required=True,
+def create_dataframes_profiled(input_path, **kwargs):
+    # Runs in a worker process and hands its stage records to the parent
+    profiler.records = []
+    reaction_df = create_dataframes(input_path, **kwargs)
+    return reaction_df, profiler.records
+
+
+def create_all_dataframes(input_paths, lc, jobs=None, use_cache=True,
+                          rebuild_cache=False, float_dtype="float64",
+                          coordinates=False, store=None, stream_rows=None):
+    # Every file is parsed independently, so they can be parsed side by side.
+    # Workers only send back the filtered reaction table, not the parsed model
+    create = partial(create_dataframes, lc=lc, use_cache=use_cache,
+                     rebuild_cache=rebuild_cache, float_dtype=float_dtype,
+                     coordinates=coordinates, store=store, stream_rows=stream_rows)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(input_paths))
+    # Models held by the server are already parsed
+    if jobs <= 1 or store is not None:
+        return [create(input_path) for input_path in input_paths]
+
+    if not profiler.enabled:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(create, input_paths))
+
+    create = partial(create_dataframes_profiled, lc=lc, use_cache=use_cache,
+                     rebuild_cache=rebuild_cache, float_dtype=float_dtype,
+                     coordinates=coordinates, stream_rows=stream_rows)
+    with profiler.stage("Parsing files in parallel"):
+        with ProcessPoolExecutor(max_workers=jobs, initializer=profiler.enable) as executor:
+            results = list(executor.map(create, input_paths))
+    for input_path, (_, records) in zip(input_paths, results):
+        profiler.records.extend(
+            dict(record, stage=f"{Path(input_path).stem}: {record['stage']}",
+                 worker=True)
+            for record in records)
+    return [reaction_df for reaction_df, _ in results]
+
+
+def changed_reactions(values, reference, atol=None, rtol=None):
+    # Reactions that differ from their reference by more than
+    # atol + rtol * |reference|, exactly when neither is given. A reaction
+    # missing on one side has changed, missing on both it has not.
+    return ~np.isclose(values, reference, rtol=rtol or 0, atol=atol or 0,
+                       equal_nan=True)
+
+
+def change_counts(comparison, changed, keep):
+    # Summary row of a comparison, changed is (row, component)
+    counts = {"comparison": comparison, "rows": len(changed),
+              "changed rows": int(np.count_nonzero(keep))}
+    for k, column in enumerate(COMPARE_COLUMNS):
+        counts[f"{column} changed"] = int(np.count_nonzero(changed[:, k]))
+    return counts
+
+
+def reaction_keys(reaction_dfs, on='node'):
+    # One int64 per row of each table, equal for rows of the same (on, lc)
+    node_codes, _ = pd.factorize(np.concatenate([df[on].to_numpy() for df in reaction_dfs]))
+    lc_dfs = [df['lc'].astype('category') for df in reaction_dfs]
+    labels = pd.Index(np.unique(np.concatenate(
+        [lc.cat.categories.astype(str) for lc in lc_dfs])))
+    keys = []
+    start = 0
+    for lc in lc_dfs:
+        lookup = labels.get_indexer(lc.cat.categories.astype(str))
+        lc_codes = lookup[lc.cat.codes.to_numpy()]
+        keys.append(node_codes[start:start + len(lc)].astype(np.int64) * len(labels)
+                    + lc_codes)
+        start += len(lc)
+    return keys
+
+
+def aligned_reactions(keys, other_keys, other_values):
+    # Rows of other_values at keys, from reaction_keys, NaN where the other
+    # table has none
+    first = ~pd.Index(other_keys).duplicated()
+    positions = pd.Index(other_keys[first]).get_indexer(keys)
+    # Position -1 picks the row of NaN at the end
+    other_values = np.vstack([other_values[first],
+                              np.full((1, other_values.shape[1]), np.nan)])
+    return other_values[positions]
+
+
+def compare_reactions(reaction_df_1, reaction_df_2, on='node', atol=None, rtol=None):
+    # Adds the differences of fx, fy and fz to the reactions of the other
+    # file to each table. With atol or rtol only rows with a change above
+    # them are kept (see changed_reactions). Also returns how many rows
+    # changed in each table.
+    keys = reaction_keys([reaction_df_1, reaction_df_2], on)
+    values = [df[COMPARE_COLUMNS].to_numpy() for df in (reaction_df_1, reaction_df_2)]
+    results = []
+    summary = []
+    for reaction_df, (i, j) in [(reaction_df_1, (0, 1)), (reaction_df_2, (1, 0))]:
+        a, b = str(i + 1), str(j + 1)
+        other_values = aligned_reactions(keys[i], keys[j], values[j])
+        changed = changed_reactions(values[i], other_values, atol, rtol)
+        keep = changed.any(axis=1)
+
+        deltas = values[i] - other_values
+        if atol is not None or rtol is not None:
+            reaction_df, deltas = reaction_df[keep], deltas[keep]
+        deltas_df = pd.DataFrame(
+            deltas, columns=[f"{column}{a}-{column}{b}" for column in COMPARE_COLUMNS])
+        results.append(pd.concat([reaction_df.reset_index(drop=True), deltas_df], axis=1))
+        summary.append(change_counts(f"{a}-{b}", changed, keep))
+
+    return results[0], results[1], pd.DataFrame(summary)
+
+
+def revision_names(input_paths):
+    # File stems, made unique and short enough for Excel sheet names
+    names = []
+    for input_path in input_paths:
+        base_name = name = Path(input_path).stem[:31]
+        count = 1
+        while name in names:
+            count += 1
+            suffix = f" ({count})"
+            name = base_name[:31 - len(suffix)] + suffix
+        names.append(name)
+    return names
+
+
+def match_support_nodes(reaction_dfs, names, tolerance=ERROR_OFFSET):
+    # Adds a node_key column to every reaction table that is the same for
+    # support nodes at the same coordinates in different revisions, however
+    # they are numbered. Also returns the node ids of each key per revision
+    # and the keys missing from at least one revision.
+    node_dfs = [df[['node', 'x', 'y', 'z']].drop_duplicates(subset=['node'])
+                for df in reaction_dfs]
+    node_keys, matches_df = match_nodes(node_dfs, tolerance)
+    matches_df.columns = ['x', 'y', 'z'] + [f"node {name}" for name in names]
+
+    keyed_dfs = []
+    for df, node_df, keys in zip(reaction_dfs, node_dfs, node_keys):
+        lookup = pd.Series(keys, index=node_df['node'].to_numpy())
+        keyed_dfs.append(df.assign(node_key=df['node'].map(lookup).to_numpy()))
+
+    node_columns = matches_df.columns[3:]
+    unmatched_df = matches_df[matches_df[node_columns].isna().any(axis=1)]
+    return keyed_dfs, matches_df, unmatched_df.reset_index(drop=True)
+
+
+def align_revisions(reaction_dfs, on='node'):
+    # Union of the (on, lc) keys of all revisions, and one
+    # (key, revision, component) array of their reactions, NaN where a
+    # revision has no reaction for the key
+    keys_df = pd.concat(
+        [df[[on, 'lc']].astype({'lc': str}) for df in reaction_dfs],
+        ignore_index=True).drop_duplicates(ignore_index=True)
+    keys = pd.MultiIndex.from_frame(keys_df)
+
+    values = np.full((len(keys), len(reaction_dfs), len(COMPARE_COLUMNS)), np.nan)
+    property_names = pd.Series(np.nan, index=range(len(keys)), dtype=object)
+    for i, df in enumerate(reaction_dfs):
+        positions = keys.get_indexer(pd.MultiIndex.from_arrays(
+            [df[on], df['lc'].astype(str)]))
+        values[positions, i, :] = widen_float32(df[COMPARE_COLUMNS]).to_numpy(dtype=float)
+        # Property of the key in the first revision that has it
+        missing = property_names.isna().to_numpy()[positions]
+        property_names.iloc[positions[missing]] = df['property_name'].to_numpy()[missing]
+    keys_df['property_name'] = property_names.to_numpy()
+    return keys_df, values
+
+
+def compare_revisions(reaction_dfs, names, baseline=0, consecutive=False,
+                      matches_df=None, atol=None, rtol=None):
+    # One row per (node, lc) over all revisions, with the reactions of each
+    # revision and their deltas, either against the baseline revision or
+    # between consecutive revisions. With matches_df from
+    # match_support_nodes rows are nodes matched by coordinates, with the
+    # node id of every revision. With atol or rtol only rows with a change
+    # above them in any delta are kept. Also returns how many rows changed
+    # in each delta.
+    if matches_df is None:
+        keys_df, values = align_revisions(reaction_dfs)
+    else:
+        keys_df, values = align_revisions(reaction_dfs, on='node_key')
+        node_columns = matches_df.columns[3:]
+        node_ids_df = matches_df[node_columns].iloc[keys_df['node_key']]
+        node_ids_df.index = keys_df.index
+        keys_df = pd.concat([
+            node_ids_df.bfill(axis=1).iloc[:, 0].rename('node'),
+            keys_df.drop(columns='node_key'), node_ids_df], axis=1)
+
+    if consecutive:
+        pairs = [(i, i - 1) for i in range(1, len(names))]
+    else:
+        pairs = [(i, baseline) for i in range(len(names)) if i != baseline]
+    compared = values[:, [i for i, _ in pairs], :]
+    reference = values[:, [j for _, j in pairs], :]
+    deltas = compared - reference
+    changed = changed_reactions(compared, reference, atol, rtol)
+    keep = changed.any(axis=(1, 2))
+    summary_df = pd.DataFrame([
+        change_counts(f"{names[i]}-{names[j]}", changed[:, p, :], changed[:, p, :].any(axis=1))
+        for p, (i, j) in enumerate(pairs)])
+
+    columns = {}
+    for i, name in enumerate(names):
+        for k, column in enumerate(COMPARE_COLUMNS):
+            columns[f"{column} {name}"] = values[:, i, k]
+    for p, (i, j) in enumerate(pairs):
+        for k, column in enumerate(COMPARE_COLUMNS):
+            columns[f"{column} {names[i]}-{names[j]}"] = deltas[:, p, k]
+
+    comparison_df = pd.concat(
+        [keys_df, pd.DataFrame(columns, index=keys_df.index)], axis=1)
+    if atol is not None or rtol is not None:
+        comparison_df = comparison_df[keep]
+    comparison_df = comparison_df.sort_values(
+        by='property_name', ascending=False, kind='stable', ignore_index=True)
+    return comparison_df, summary_df
+
+
+def run(input_path_1, input_path_2, lc, use_cache=True, rebuild_cache=False,
+        jobs=None, fmt="xlsx", float_dtype="float64", match_coordinates=False,
+        tolerance=ERROR_OFFSET, store=None, stream_rows=None, atol=None,
+        rtol=None):
+    reaction_df_1, reaction_df_2 = create_all_dataframes(
+        [input_path_1, input_path_2], lc, jobs=jobs, use_cache=use_cache,
+        rebuild_cache=rebuild_cache, float_dtype=float_dtype,
+        coordinates=match_coordinates, store=store, stream_rows=stream_rows)
+    sheets = {}
+    if match_coordinates:
+        with profiler.stage("Matching nodes by coordinates"):
+            (reaction_df_1, reaction_df_2), _, unmatched_df = match_support_nodes(
+                [reaction_df_1, reaction_df_2],
+                revision_names([input_path_1, input_path_2]), tolerance)
+        report_unmatched(unmatched_df, sheets)
+
+    with profiler.stage("Comparing reactions"):
+        on = 'node_key' if match_coordinates else 'node'
+        reaction_df_1, reaction_df_2, summary_df = compare_reactions(
+            reaction_df_1, reaction_df_2, on=on, atol=atol, rtol=rtol)
+        names = [Path(input_path_1).stem, Path(input_path_2).stem]
+        summary_df['comparison'] = [f"{names[0]}-{names[1]}", f"{names[1]}-{names[0]}"]
+        report_changes(summary_df, sheets, atol, rtol)
+        if match_coordinates:
+            reaction_df_1 = reaction_df_1.drop(columns=on)
+            reaction_df_2 = reaction_df_2.drop(columns=on)
+
+    with profiler.stage("Writing report"):
+        write_report(dict({
+            Path(input_path_1).stem: reaction_df_1,
+            Path(input_path_2).stem: reaction_df_2,
+        }, **sheets), "reaction_report", fmt)
+
+
+def report_changes(summary_df, sheets, atol=None, rtol=None):
+    # Only written when rows were left out of the comparison
+    if atol is None and rtol is None:
+        return
+    for row in summary_df.to_dict("records"):
+        print(f"{row['comparison']}: {row['changed rows']} of {row['rows']} rows "
+              "changed by more than the tolerance")
+    sheets["changes"] = summary_df
+
+
+def report_unmatched(unmatched_df, sheets):
+    if unmatched_df is not None and len(unmatched_df):
+        print(f"{len(unmatched_df)} support nodes have no match within the "
+              "tolerance in every revision, see the unmatched nodes sheet")
+        sheets["unmatched nodes"] = unmatched_df
+
+
+def run_revisions(input_paths, lc, use_cache=True, rebuild_cache=False,
+                  jobs=None, fmt="xlsx", float_dtype="float64", baseline=None,
+                  consecutive=False, match_coordinates=False,
+                  tolerance=ERROR_OFFSET, store=None, stream_rows=None,
+                  atol=None, rtol=None):
+    # baseline is the path or file stem of one of the input files and
+    # defaults to the first one
+    names = revision_names(input_paths)
+    baseline_index = 0
+    if baseline is not None:
+        stems = [Path(input_path).stem for input_path in input_paths]
+        if baseline in input_paths:
+            baseline_index = input_paths.index(baseline)
+        elif baseline in stems:
+            baseline_index = stems.index(baseline)
+        else:
+            raise ValueError(f"Baseline {baseline} is not one of the input files")
+
+    reaction_dfs = create_all_dataframes(
+        input_paths, lc, jobs=jobs, use_cache=use_cache,
+        rebuild_cache=rebuild_cache, float_dtype=float_dtype,
+        coordinates=match_coordinates, store=store, stream_rows=stream_rows)
+    matches_df = unmatched_df = None
+    if match_coordinates:
+        with profiler.stage("Matching nodes by coordinates"):
+            reaction_dfs, matches_df, unmatched_df = match_support_nodes(
+                reaction_dfs, names, tolerance)
+
+    with profiler.stage("Comparing reactions"):
+        comparison_df, summary_df = compare_revisions(
+            reaction_dfs, names, baseline_index, consecutive, matches_df,
+            atol=atol, rtol=rtol)
+
+    with profiler.stage("Writing report"):
+        sheets = {"comparison": comparison_df}
+        report_changes(summary_df, sheets, atol, rtol)
+        sheets.update(
+            (name, df.drop(columns='node_key', errors='ignore'))
+            for name, df in zip(names, reaction_dfs))
+        report_unmatched(unmatched_df, sheets)
+        write_report(sheets, "reaction_report", fmt)
+
+
+def main(argv=None, store=None):
+    parser = argparse.ArgumentParser(prog="reaction.py")
+    parser.add_argument("--input_path_1",
                         type=str, help="Path of the first input file")
-    parser.add_argument("--input_path_2", required=True,
+    parser.add_argument("--input_path_2",
                         type=str, help="Path of the second input file")
+    parser.add_argument("--input_path", action="append", default=[],
+                        help="Path of a revision to compare, repeat it for every revision. "
+                             "Writes one comparison sheet of all revisions")
+    parser.add_argument("--baseline", type=str,
+                        help="Path or file name of the revision the others are compared "
+                             "to, defaults to the first --input_path")
+    parser.add_argument("--consecutive", action="store_true",
+                        help="Compare every revision to the one before it instead of the baseline")
+    parser.add_argument("--match_coordinates", "--match-coordinates", action="store_true",
+                        help="Pair support nodes of the revisions by coordinates instead "
+                             "of node number, for renumbered models")
+    parser.add_argument("--tolerance", type=float, default=ERROR_OFFSET,
+                        help=f"Largest coordinate difference of matched nodes (default {ERROR_OFFSET})")
+    parser.add_argument("--atol", type=float, default=None,
+                        help="Only report rows where fx, fy or fz changed by more than this")
+    parser.add_argument("--rtol", type=float, default=None,
+                        help="Only report rows where fx, fy or fz changed by more than this "
+                             "share of the revision they are compared to, added to --atol")
     parser.add_argument("--lc", required=True, type=str,
                         help="List of load cases, e.g. '[1, 2, 203]'")
-    args = parser.parse_args()
-    input_path_1 = args.input_path_1
-    input_path_2 = args.input_path_2
+    parser.add_argument("--no_cache", "--no-cache", action="store_true",
+                        help="Parse the input without reading or writing the cache")
+    parser.add_argument("--rebuild_cache", "--rebuild-cache", action="store_true",
+                        help="Parse the input again and replace its cache entry")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Number of files parsed in parallel, defaults to the number of CPUs")
+    parser.add_argument("--format", choices=FORMATS, default="xlsx",
+                        help="reaction_report.xlsx, or one csv/parquet file per sheet in reaction_report/")
+    parser.add_argument("--float32", action="store_true",
+                        help="Keep forces and moments as float32 to halve their memory")
+    parser.add_argument("--stream", nargs="?", type=int, const=CHUNK_ROWS,
+                        metavar="ROWS",
+                        help=f"Read reactions ROWS rows at a time (default {CHUNK_ROWS} "
+                             "rows), for exports larger than memory")
+    parser.add_argument("--profile", nargs="?", const="profile.json",
+                        help="Record time and memory of every stage, print a summary "
+                             "and save it as JSON (default profile.json)")
+    parser.add_argument("--cprofile", type=str,
+                        help="Save cProfile stats of the slowest stage to this path")
+    parser.add_argument("--no_server", "--no-server", action="store_true",
+                        help="Run in this process even when server.py is running")
+    argv = sys.argv[1:] if argv is None else argv
+    args = parser.parse_args(argv)
+
+    if args.profile or args.cprofile:
+        profiler.enable(use_cprofile=bool(args.cprofile))
+    if args.tolerance <= 0:
+        parser.error("--tolerance must be positive")
+    if (args.atol or 0) < 0 or (args.rtol or 0) < 0:
+        parser.error("--atol and --rtol cannot be negative")
     lc = [str(item) for item in ast.literal_eval(args.lc)] if args.lc else None
-    run(input_path_1, input_path_2, lc)
+    float_dtype = "float32" if args.float32 else "float64"
+    if args.input_path:
+        input_paths = [path for path in (args.input_path_1, args.input_path_2) if path]
+        input_paths += args.input_path
+        if len(input_paths) < 2:
+            parser.error("at least two input files are needed")
+        run_revisions(input_paths, lc, use_cache=not args.no_cache,
+                      rebuild_cache=args.rebuild_cache, jobs=args.jobs,
+                      fmt=args.format, float_dtype=float_dtype,
+                      baseline=args.baseline, consecutive=args.consecutive,
+                      match_coordinates=args.match_coordinates,
+                      tolerance=args.tolerance, store=store,
+                      stream_rows=args.stream, atol=args.atol, rtol=args.rtol)
+    else:
+        if not (args.input_path_1 and args.input_path_2):
+            parser.error("--input_path_1 and --input_path_2, or --input_path, are required")
+        run(args.input_path_1, args.input_path_2, lc, use_cache=not args.no_cache,
+            rebuild_cache=args.rebuild_cache, jobs=args.jobs, fmt=args.format,
+            float_dtype=float_dtype, match_coordinates=args.match_coordinates,
+            tolerance=args.tolerance, store=store, stream_rows=args.stream,
+            atol=args.atol, rtol=args.rtol)
+    if profiler.enabled:
+        profiler.report(args.profile or "profile.json", args.cprofile)
+
+
+if __name__ == "__main__":
+    main()
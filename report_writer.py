@@ -0,0 +1,96 @@
+import re
+from pathlib import Path
+import pandas as pd
+
+FORMATS = ["xlsx", "csv", "parquet"]
+
+EXCEL_MAX_ROWS = 1048576
+# Above this many rows in total the workbook is streamed row by row with
+# xlsxwriter's constant_memory mode instead of built in memory by pandas
+CONSTANT_MEMORY_ROWS = 100000
+
+
+def write_report(sheets, output, fmt="xlsx"):
+    # sheets maps a sheet name to a DataFrame. xlsx writes one workbook
+    # named output.xlsx, csv and parquet write one file per sheet into the
+    # output directory.
+    if fmt == "xlsx":
+        # Appended, a dot in output is part of its name
+        output = Path(output)
+        path = output.parent / f"{output.name}.xlsx"
+        if sum(len(df) for df in sheets.values()) > CONSTANT_MEMORY_ROWS:
+            write_excel_streaming(sheets, path)
+        else:
+            write_excel(sheets, path)
+    elif fmt in ("csv", "parquet"):
+        write_files(sheets, Path(output), fmt)
+    else:
+        raise ValueError(f"Unknown report format {fmt}, expected one of {FORMATS}")
+
+
+def widen_float32(df):
+    # Excel stores doubles, and a float32 such as 294.572 would show up as
+    # 294.571991. Going through the shortest decimal text of each float32
+    # keeps the value as printed.
+    float32_columns = df.select_dtypes("float32").columns
+    if len(float32_columns) == 0:
+        return df
+    df = df.copy()
+    for column in float32_columns:
+        df[column] = df[column].to_numpy().astype(str).astype("float64")
+    return df
+
+
+def split_sheets(sheets):
+    # Sheets longer than Excel allows continue on "<name> (2)", "<name> (3)"...
+    max_rows = EXCEL_MAX_ROWS - 1
+    for sheet_name, df in sheets.items():
+        df = widen_float32(df)
+        if len(df) <= max_rows:
+            yield sheet_name, df
+            continue
+        for part, start in enumerate(range(0, len(df), max_rows), start=1):
+            if part > 1:
+                suffix = f" ({part})"
+                sheet_name = sheet_name[:31 - len(suffix)] + suffix
+            yield sheet_name, df.iloc[start:start + max_rows]
+
+
+def write_excel(sheets, path):
+    with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+        for sheet_name, df in split_sheets(sheets):
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+
+
+def write_excel_streaming(sheets, path):
+    import xlsxwriter
+
+    # constant_memory flushes each row once the next one starts, so cells
+    # have to be written row by row (pandas writes them column by column)
+    workbook = xlsxwriter.Workbook(str(path), {"constant_memory": True})
+    header_format = workbook.add_format({"bold": True, "border": 1})
+    try:
+        for sheet_name, df in split_sheets(sheets):
+            worksheet = workbook.add_worksheet(sheet_name)
+            worksheet.write_row(0, 0, [str(c) for c in df.columns], header_format)
+            rows = df.astype(object).where(df.notna(), None)
+            for i, row in enumerate(rows.itertuples(index=False, name=None), start=1):
+                worksheet.write_row(i, 0, row)
+    finally:
+        workbook.close()
+
+
+def write_files(sheets, directory, fmt):
+    directory.mkdir(parents=True, exist_ok=True)
+    for sheet_name, df in sheets.items():
+        file_name = re.sub(r"[^\w\-. ()]", "_", sheet_name)
+        path = directory / f"{file_name}.{fmt}"
+        if fmt == "csv":
+            df.to_csv(path, index=False)
+        else:
+            try:
+                df.to_parquet(path, index=False)
+            except ImportError as e:
+                raise ImportError(
+                    "Writing parquet reports needs pyarrow, install it with "
+                    "'pip install pyarrow'") from e
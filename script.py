@@ -1,31 +1,34 @@
+import server
+
+if __name__ == "__main__":
+    server.forward("script")
+
+import numpy as np
 import pandas as pd
 import argparse
 import ast
-from io import StringIO
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from pathlib import Path
+from cache import load_derived
+from envelope import envelope as force_envelope
+from collections import namedtuple
+from profiling import profiler
+from report_writer import FORMATS, write_report
+from staad import CHUNK_ROWS
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, --worker_memory_mb is then rejected
+    resource = None
 
 ERROR_OFFSET = 0.01
 
-def extract_table(lines, start_keyword, next_keywords):
-    start = None
-    end = None
-    for i, line in enumerate(lines):
-        if start is None and start_keyword in line:
-            start = i
-        elif start is not None and any(k in line for k in next_keywords):
-            end = i
-            break
-    return lines[start:end] if start is not None else []
-
-
-def parse_table(table_lines, dtype=None):
-    table_str = "\n".join(table_lines)
-    if dtype is not None:
-        df = pd.read_csv(StringIO(table_str), header=None, dtype=dtype)
-    else:
-        df = pd.read_csv(StringIO(table_str), header=None, low_memory=False)
-    df = df.dropna(how='all', axis=0).dropna(how='all', axis=1)
-    return df
-
+JointIndex = namedtuple("JointIndex", ["beam_ends_df", "node_ids", "coordinates"])
 
 def get_intersection(set_1, set_2):
     common = set_1 & set_2
@@ -34,29 +37,68 @@ def get_intersection(set_1, set_2):
     return None
 
 
-def update_reaction_table(sections_df, beams_df, beam_end_forces_df, reaction_df):
-    # Step 1: Get the first beam_id for each node from beam_end_forces_df
-    node_to_beam = beam_end_forces_df.drop_duplicates(
-        subset=['node'], keep='first')[['node', 'beam_id']]
+def node_coordinates(nodes_df):
+    # Sorted node ids and their float (x, y, z) rows, looked up with
+    # node_rows. Node ids can be far larger than the number of nodes.
+    # Keep the first row of a duplicated node id
+    first = ~nodes_df["node"].duplicated().to_numpy()
+    node_ids = nodes_df["node"].to_numpy()[first]
+    order = np.argsort(node_ids, kind="stable")
+    coordinates = nodes_df[["x", "y", "z"]].to_numpy(dtype=float)[first][order]
+    return node_ids[order], coordinates
+
+
+def node_rows(node_ids, nodes):
+    # Row of each node in the sorted node_ids, -1 for nodes not in it
+    rows = np.full(len(nodes), -1)
+    if len(node_ids) == 0:
+        return rows
+    found = np.minimum(np.searchsorted(node_ids, nodes), len(node_ids) - 1)
+    matches = node_ids[found] == nodes
+    rows[matches] = found[matches]
+    return rows
 
-    # Step 2: Merge reaction_df with node_to_beam to get beam_id
-    reaction_df = reaction_df.merge(node_to_beam, on='node', how='left')
 
-    # Step 3: Merge with beams_df to get property_id
-    reaction_df = reaction_df.merge(
+def node_properties(sections_df, beams_df, node_to_beam_df):
+    # Step 1: Start from node_to_beam_df, the first beam_id of each node in
+    # the beam end forces table
+    node_properties_df = node_to_beam_df[['node', 'beam_id']]
+
+    # Step 2: Merge with beams_df to get property_id
+    node_properties_df = node_properties_df.merge(
         beams_df[['beam_id', 'property_id']], on='beam_id', how='left')
 
-    # Step 4: Merge with sections_df to get property_name
-    reaction_df = reaction_df.merge(
+    # Step 3: Merge with sections_df to get property_name
+    node_properties_df = node_properties_df.merge(
         sections_df[['property_id', 'name']], on='property_id', how='left')
 
-    # Step 5: Rename the 'name' column to 'property_name'
-    reaction_df = reaction_df.rename(columns={'name': 'property_name'})
+    # Step 4: Rename the 'name' column to 'property_name'
+    return node_properties_df.rename(columns={'name': 'property_name'})
+
+
+def update_reaction_table(sections_df, beams_df, node_to_beam_df, reaction_df):
+    # Adds the beam_id, property_id and property_name of each node
+    node_properties_df = node_properties(sections_df, beams_df, node_to_beam_df)
+    return reaction_df.merge(node_properties_df, on='node', how='left')
+
 
-    return reaction_df
+def build_joint_index(beams_df, nodes_df):
+    # Beam ends by node and node coordinates, shared by every class pair
+    beam_ends_df = pd.concat([
+        beams_df[["beam_id", "node_a", "property_id"]].rename(
+            columns={"node_a": "node"}),
+        beams_df[["beam_id", "node_b", "property_id"]].rename(
+            columns={"node_b": "node"})
+    ])
+    node_ids, coordinates = node_coordinates(nodes_df)
+    return JointIndex(beam_ends_df, node_ids, coordinates)
 
 
-def force_report(sections_df, beams_df, beam_end_forces_df, nodes_df):
+def find_joints(sections_df, beams_df, nodes_df, class_1, class_2,
+                joint_index=None):
+    if joint_index is None:
+        joint_index = build_joint_index(beams_df, nodes_df)
+
     filtered_sections_class_1_df = sections_df[sections_df["name"] == class_1]
     filtered_sections_class_2_df = sections_df[sections_df["name"] == class_2]
 
@@ -65,181 +107,504 @@ def force_report(sections_df, beams_df, beam_end_forces_df, nodes_df):
     filtered_beams_class_2_df = beams_df[beams_df["property_id"].isin(
         filtered_sections_class_2_df["property_id"])]
 
-    # Step 1: Create the Cartesian product (cross join)
-    cross_df = filtered_beams_class_1_df.assign(key=1).merge(
-        filtered_beams_class_2_df.assign(key=1),
-        on="key",
+    # Step 1: Pair only the beam ends of both classes that meet at a node
+    beam_ends_df = joint_index.beam_ends_df
+    beam_ends_class_1_df = beam_ends_df[beam_ends_df["property_id"].isin(
+        filtered_sections_class_1_df["property_id"])]
+    beam_ends_class_2_df = beam_ends_df[beam_ends_df["property_id"].isin(
+        filtered_sections_class_2_df["property_id"])]
+
+    pairs_df = beam_ends_class_1_df[["beam_id", "node"]].merge(
+        beam_ends_class_2_df[["beam_id", "node"]],
+        on="node",
         suffixes=('_1', '_2')
-    ).drop(columns=["key"])
+    )
 
     # Step 2: Remove rows with same beam_id
-    cross_df = cross_df[cross_df["beam_id_1"] != cross_df["beam_id_2"]]
-
-    # Step 3: Apply the intersection logic
-    def get_common_node(row):
-        nodes_1 = {row["node_a_1"], row["node_b_1"]}
-        nodes_2 = {row["node_a_2"], row["node_b_2"]}
-        common = nodes_1 & nodes_2
-
-        # Condition 1: Check if common node exists
-        if not common:
-            return None
-
-        # Remove common nodes from combination of sets
-        remaining_nodes = (nodes_1 | nodes_2) - common
-
-        # Should have exactly 2 remaining nodes after removing common node(s)
-        if len(remaining_nodes) != 2:
-            return None
-
-        # Convert to list to access by index
-        remaining_nodes_list = list(remaining_nodes)
-        node1 = remaining_nodes_list[0]
-        node2 = remaining_nodes_list[1]
-
-        # Condition 2: Check if these two nodes have at least two common values on their axis (x,y,z)
-        try:
-            # Get coordinates for both nodes
-            node1_info = nodes_df[nodes_df['node'] == node1].iloc[0]
-            node2_info = nodes_df[nodes_df['node'] == node2].iloc[0]
-
-            # Check how many coordinates are the same
-            common_coordinates = 0
-            if abs(float(node1_info['x']) - float(node2_info['x'])) <= ERROR_OFFSET:
-                common_coordinates += 1
-            if abs(float(node1_info['y']) - float(node2_info['y'])) <= ERROR_OFFSET:
-                common_coordinates += 1
-            if abs(float(node1_info['z']) - float(node2_info['z'])) <= ERROR_OFFSET:
-                common_coordinates += 1
-
-            # If at least two coordinates are common, return None
-            if common_coordinates >= 2:
-                return None
-            else:
-                # Otherwise return the common node
-                return common.pop()
-
-        except (IndexError, KeyError):
-            # If nodes not found in nodes_df, return None
-            return None
-
-    cross_df["node"] = cross_df.apply(get_common_node, axis=1)
-
-    # Step 4: Filter rows where a common node was found
-    intersection_beams_df = cross_df[cross_df["node"].notnull()]
-    intersection_beams_df = intersection_beams_df.drop_duplicates()
-    intersection_beams_df = intersection_beams_df.drop_duplicates()
-
-    # Step 5: filter force dataframe based on intersection beams
+    pairs_df = pairs_df[pairs_df["beam_id_1"] != pairs_df["beam_id_2"]]
+
+    # Step 3: Keep pairs with exactly one common node. Beams sharing both
+    # nodes, or zero-length beams, show up more than once per pair
+    pair_count = pairs_df.groupby(
+        ["beam_id_1", "beam_id_2"])["node"].transform("size")
+    pairs_df = pairs_df[pair_count == 1]
+
+    cross_df = pairs_df.merge(
+        filtered_beams_class_1_df.add_suffix("_1"), on="beam_id_1"
+    ).merge(
+        filtered_beams_class_2_df.add_suffix("_2"), on="beam_id_2"
+    )
+    cross_df = cross_df[
+        [f"{c}_1" for c in beams_df.columns] +
+        [f"{c}_2" for c in beams_df.columns] + ["node"]]
+
+    # Step 4: The two far ends must not share two coordinates (x,y,z),
+    # otherwise the beams are in line with each other and do not form a joint
+    node_ids, coordinates = joint_index.node_ids, joint_index.coordinates
+
+    node = cross_df["node"].to_numpy()
+    node1 = np.where(cross_df["node_a_1"].to_numpy() == node,
+                     cross_df["node_b_1"].to_numpy(), cross_df["node_a_1"].to_numpy())
+    node2 = np.where(cross_df["node_a_2"].to_numpy() == node,
+                     cross_df["node_b_2"].to_numpy(), cross_df["node_a_2"].to_numpy())
+
+    # Nodes missing from nodes_df never form a joint
+    rows1 = node_rows(node_ids, node1)
+    rows2 = node_rows(node_ids, node2)
+    found = (rows1 >= 0) & (rows2 >= 0)
+
+    common_coordinates = np.zeros(len(node), dtype=int)
+    common_coordinates[found] = (
+        np.abs(coordinates[rows1[found]] - coordinates[rows2[found]]) <= ERROR_OFFSET
+    ).sum(axis=1)
+
+    cross_df = cross_df[found & (common_coordinates < 2)]
+
+    # Step 5: Keep the rows where a joint was found
+    return cross_df.drop_duplicates()
+
+
+def joint_forces(beam_end_forces_df, intersection_beams_df, lc):
+    # Step 6: filter force dataframe based on intersection beams
+    at_joints = joint_rows([intersection_beams_df])(beam_end_forces_df)
     filtered_forces_df = beam_end_forces_df[
-        (beam_end_forces_df["lc"].isin(lc)) &
-        (
-            beam_end_forces_df[["node", "beam_id"]]
-            .apply(tuple, axis=1)
-            .isin(
-                pd.concat([
-                    intersection_beams_df[["node", "beam_id_1"]].rename(
-                        columns={"beam_id_1": "beam_id"}),
-                    intersection_beams_df[["node", "beam_id_2"]].rename(
-                        columns={"beam_id_2": "beam_id"})
-                ])
-                .apply(tuple, axis=1)
-            )
-        )
-    ]
-
+        (beam_end_forces_df["lc"].isin(lc)) & at_joints]
     return filtered_forces_df
 
 
-def run(input_path, class_1, class_2, lc):
-    # Load CSV lines, skipping the first 15 lines
-    with open(input_path, encoding="iso-8859-1") as f:
-        lines = f.readlines()[30:]
-
-    # Extract tables
-    nodes_lines = extract_table(lines, "Nodes", ["Beams"])
-    beams_lines = extract_table(lines, "Beams", ["Supports", "Sections"])
-    sections_lines = extract_table(
-        lines, "Sections", ["Supports",  "STAAD.Pro"])
-    reaction_lines = extract_table(
-        lines, "Reactions", ["Beam End Forces"])
-    beam_end_forces_lines = extract_table(
-        lines, "Beam End Forces", ["Max Forces by Property"])
-
-    # Parse to DataFrames
-    print("Parsing nodes...")
-    nodes_df = parse_table(nodes_lines)
-    nodes_df = nodes_df.iloc[3:, 1:].reset_index(drop=True)
-    nodes_df.columns = ["node", "x", "y", "z"]
-    nodes_df['node'] = nodes_df['node'].astype(int)
-
-    print("Parsing sections...")
-    sections_df = parse_table(sections_lines)
-    sections_df = sections_df.iloc[3:, 1:].reset_index(drop=True)
-    sections_df.columns = ["property_id", "name",
-                           "area", "iyy", "izz", "j", "material", "source"]
-    sections_df['property_id'] = sections_df['property_id'].astype(int)
-
-    print("Parsing beams...")
-    beams_df = parse_table(beams_lines)
-    beams_df = beams_df.iloc[3:, 1:].reset_index(drop=True)
-    beams_df.columns = ["beam_id", "node_a",
-                        "node_b", "len", "property_id", "beta"]
-    beams_df['beam_id'] = beams_df['beam_id'].astype(int)
-    beams_df['node_a'] = beams_df['node_a'].astype(int)
-    beams_df['node_b'] = beams_df['node_b'].astype(int)
-    beams_df['property_id'] = beams_df['property_id'].astype(int)
-
-    print("Parsing forces...")
-    beam_end_forces_df = parse_table(beam_end_forces_lines)
-    beam_end_forces_df = beam_end_forces_df.iloc[4:, 1:].reset_index(drop=True)
-    beam_end_forces_df.columns = [
-        "beam_id", "node", "lc", "fx", "fy", "fz", "mx", "my", "mz"]
-    beam_end_forces_df['beam_id'] = beam_end_forces_df['beam_id'].ffill()
-    beam_end_forces_df['beam_id'] = beam_end_forces_df['beam_id'].astype(int)
-    beam_end_forces_df['node'] = beam_end_forces_df['node'].astype(int)
-
-    print("Parsing reactions...")
-    reaction_df = parse_table(reaction_lines)
-    reaction_df = reaction_df.iloc[4:, 1:].reset_index(drop=True)
-    reaction_df.columns = ["node", "lc", "fx", "fy", "fz", "mx", "my", "mz"]
-    reaction_df['node'] = reaction_df['node'].ffill()
-    reaction_df['node'] = reaction_df['node'].astype(int)
-    reaction_df = update_reaction_table(
-        sections_df, beams_df, beam_end_forces_df, reaction_df)
-    reaction_df = reaction_df[reaction_df["lc"].isin(lc)]
-    reaction_df = reaction_df.sort_values(by='property_name', ascending=False)
-
-    filtered_forces_df = force_report(
-        sections_df, beams_df, beam_end_forces_df, nodes_df)
-
-    with pd.ExcelWriter("report.xlsx", engine='xlsxwriter') as writer:
-        filtered_forces_df.to_excel(
-            writer, sheet_name="final force report", index=False)
-        sections_df.to_excel(
-            writer, sheet_name="extracted sections", index=False)
-        beams_df.to_excel(writer, sheet_name="extracted beams", index=False)
-        beam_end_forces_df.to_excel(
-            writer, sheet_name="extracted forces", index=False)
-        reaction_df.to_excel(
-            writer, sheet_name="extracted reactions", index=False)
-        nodes_df.to_excel(
-            writer, sheet_name="extracted nodes", index=False)
-
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--input_path", required=True,
+def force_report(sections_df, beams_df, beam_end_forces_df, nodes_df,
+                 class_1, class_2, lc, joint_index=None):
+    intersection_beams_df = find_joints(
+        sections_df, beams_df, nodes_df, class_1, class_2, joint_index)
+    return joint_forces(beam_end_forces_df, intersection_beams_df, lc)
+
+
+def beam_end_keys(node, beam_id):
+    # One int64 per (node, beam_id), -1 for rows without both
+    node = np.asarray(node, dtype=np.float64)
+    beam_id = np.asarray(beam_id, dtype=np.float64)
+    known = ~np.isnan(node) & ~np.isnan(beam_id)
+    keys = np.full(len(node), -1, dtype=np.int64)
+    keys[known] = (node[known].astype(np.int64) << 32) + beam_id[known].astype(np.int64)
+    return keys
+
+
+def joint_rows(intersection_beams_dfs):
+    # Chunk filter of the forces at the beam ends of the joints, for
+    # staad.stream_typed
+    keys = np.unique(np.concatenate([
+        beam_end_keys(df["node"], df[beam_column])
+        for df in intersection_beams_dfs
+        for beam_column in ["beam_id_1", "beam_id_2"]] + [np.empty(0, dtype=np.int64)]))
+    return lambda values: np.isin(beam_end_keys(values["node"], values["beam_id"]), keys)
+
+
+def find_all_joints(tables, class_pairs, use_cache=True, rebuild_cache=False):
+    # Intersection beams of every class pair. They only depend on the nodes,
+    # beams and sections, so they are reused from the cache for revisions
+    # that only change loads, and the joint index is only built when one of
+    # them has to be found again.
+    joint_index = None
+    joints = {}
+    for class_1, class_2 in class_pairs:
+        def find():
+            nonlocal joint_index
+            # Loaded, or parsed, before the stages that use them
+            sections_df = tables["sections"]
+            beams_df = tables["beams"]
+            nodes_df = tables["nodes"]
+            if joint_index is None:
+                with profiler.stage("Building joint index"):
+                    joint_index = build_joint_index(beams_df, nodes_df)
+            with profiler.stage(f"Finding joints of {class_1} and {class_2}"):
+                return find_joints(sections_df, beams_df, nodes_df,
+                                   class_1, class_2, joint_index)
+
+        joints[(class_1, class_2)] = load_derived(
+            tables, f"joints {class_1} {class_2}", find,
+            use_cache=use_cache, rebuild_cache=rebuild_cache)
+    return joints
+
+
+def run(input_path, class_1, class_2, lc, use_cache=True, rebuild_cache=False,
+        fmt="xlsx", lean=False, float_dtype="float64", store=None, envelope=None,
+        stream_rows=None):
+    run_batch(input_path, {"final force report": (class_1, class_2, lc)},
+              use_cache=use_cache, rebuild_cache=rebuild_cache, fmt=fmt,
+              lean=lean, float_dtype=float_dtype, store=store, envelope=envelope,
+              stream_rows=stream_rows)
+
+
+def run_batch(input_path, reports, use_cache=True, rebuild_cache=False,
+              fmt="xlsx", lean=False, float_dtype="float64", store=None,
+              output="report", envelope=None, stream_rows=None):
+    sheets = report_sheets(input_path, reports, use_cache=use_cache,
+                           rebuild_cache=rebuild_cache, lean=lean,
+                           float_dtype=float_dtype, store=store, envelope=envelope,
+                           stream_rows=stream_rows)
+    with profiler.stage("Writing report"):
+        write_report(sheets, output, fmt)
+
+
+def report_sheets(input_path, reports, use_cache=True, rebuild_cache=False,
+                  lean=False, float_dtype="float64", store=None, envelope=None,
+                  stream_rows=None):
+    # reports maps a sheet name to (class_1, class_2, lc). The model is parsed
+    # once for the union of all load cases and the joint index is shared.
+    # store is the server.ModelStore of the models kept in memory by the
+    # server, when running there. envelope="next" adds the envelopes of the
+    # forces and reactions, envelope="only" writes them instead of the
+    # force reports. With stream_rows the forces and reactions are read
+    # stream_rows rows at a time and only the forces at the joints are kept,
+    # the extracted forces are then those forces.
+    all_lc = sorted({item for _, _, report_lc in reports.values()
+                     for item in report_lc})
+    tables = server.load_tables(input_path, all_lc, float_dtype, use_cache,
+                                rebuild_cache, store)
+    # The index the tables are parsed from, a file without any table would
+    # otherwise give empty reports
+    if not tables.index.sections:
+        raise ValueError("no STAAD table found")
+    node_properties_df = load_derived(
+        tables, "node properties",
+        lambda: node_properties(
+            tables["sections"], tables["beams"], tables["node_to_beam"]),
+        use_cache=use_cache, rebuild_cache=rebuild_cache)
+    # Models held by the server are already in memory
+    stream = stream_rows is not None and store is None
+    if stream:
+        reaction_df = tables.stream("reactions", chunk_rows=stream_rows)
+    else:
+        reaction_df = tables["reactions"]
+    with profiler.stage("Updating reactions"):
+        reaction_df = reaction_df.merge(node_properties_df, on='node', how='left')
+        reaction_df = reaction_df.sort_values(
+            by='property_name', ascending=False)
+
+    joints = find_all_joints(
+        tables, dict.fromkeys((c1, c2) for c1, c2, _ in reports.values()),
+        use_cache=use_cache, rebuild_cache=rebuild_cache)
+    if stream:
+        beam_end_forces_df = tables.stream(
+            "beam_end_forces", keep=joint_rows(joints.values()),
+            chunk_rows=stream_rows)
+    else:
+        beam_end_forces_df = tables["beam_end_forces"]
+
+    sheets = {}
+    for sheet_name, (class_1, class_2, lc) in reports.items():
+        with profiler.stage(f"Filtering forces of {class_1} and {class_2}"):
+            sheets[sheet_name] = joint_forces(
+                beam_end_forces_df, joints[(class_1, class_2)], lc)
+
+    if envelope is not None:
+        sections_df = tables["sections"]
+        beams_df = tables["beams"]
+        with profiler.stage("Computing envelopes"):
+            envelope_sheets = envelopes(
+                {sheet_name: sheets[sheet_name] for sheet_name in reports},
+                reaction_df, sections_df, beams_df)
+        if envelope == "only":
+            sheets = {}
+        sheets.update(envelope_sheets)
+
+    if not lean:
+        sheets["extracted sections"] = tables["sections"]
+        sheets["extracted beams"] = tables["beams"]
+        sheets["extracted forces"] = beam_end_forces_df
+        sheets["extracted reactions"] = reaction_df
+        sheets["extracted nodes"] = tables["nodes"]
+    return sheets
+
+
+def envelopes(force_reports, reaction_df, sections_df, beams_df):
+    # Step 1: property name of each beam
+    beam_properties_df = beams_df[['beam_id', 'property_id']].merge(
+        sections_df[['property_id', 'name']], on='property_id', how='left')
+    beam_properties_df = beam_properties_df[['beam_id', 'name']].rename(
+        columns={'name': 'property_name'})
+
+    # Step 2: envelope of each joint member end, and of each property over
+    # the joints, of every force report
+    sheets = {}
+    taken = set(force_reports) | {"property envelope", "reaction envelope",
+                                  "reaction property envelope"}
+    property_envelopes = []
+    for sheet_name, forces_df in force_reports.items():
+        forces_df = forces_df.merge(beam_properties_df, on='beam_id', how='left')
+        envelope_name = unique_sheet_name(sheet_name, taken, " envelope")
+        taken.add(envelope_name)
+        sheets[envelope_name] = force_envelope(
+            forces_df, ["property_name", "node", "beam_id"])
+        property_envelopes.append(force_envelope(forces_df, ["property_name"])
+                                  .assign(report=sheet_name))
+    property_envelope_df = pd.concat(property_envelopes, ignore_index=True)
+    sheets["property envelope"] = property_envelope_df[
+        ["report"] + list(property_envelope_df.columns[:-1])]
+
+    # Step 3: envelope of each support node and each support property
+    sheets["reaction envelope"] = force_envelope(
+        reaction_df, ["property_name", "node"])
+    sheets["reaction property envelope"] = force_envelope(
+        reaction_df, ["property_name"])
+    return sheets
+
+
+def limit_memory(max_bytes):
+    # Caps the heap of a worker process, an export that does not fit then
+    # fails with a MemoryError instead of exhausting the machine
+    if max_bytes is None:
+        return
+    resource.setrlimit(resource.RLIMIT_DATA, (max_bytes, max_bytes))
+
+
+def process_file(input_path, reports, output=None, fmt="xlsx", **kwargs):
+    # One file of run_directory. With output the report of the file is
+    # written there and nothing is returned, otherwise the force reports are
+    # returned to be consolidated. Errors are returned instead of raised so
+    # that the other files still run.
+    try:
+        if output is None:
+            return report_sheets(input_path, reports, lean=True, **kwargs), None
+        run_batch(input_path, reports, fmt=fmt, output=output, **kwargs)
+        return {}, None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def process_in_pool(process, input_paths, outputs, jobs, max_bytes):
+    # Results of the files that ran, and the files the pool broke on
+    results = {}
+    broken = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=limit_memory,
+                             initargs=(max_bytes,)) as executor:
+        futures = {executor.submit(process, input_path,
+                                   output=outputs[input_path]): input_path
+                   for input_path in input_paths}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except BrokenProcessPool:
+                broken.append(futures[future])
+    return results, sorted(broken)
+
+
+def report_paths(input_paths, output_dir):
+    # report_<file name> for each file, numbered when names only differ in
+    # case, and without a suffix for write_report to add
+    paths = {}
+    taken = set()
+    for input_path in input_paths:
+        base_name = name = f"report_{Path(input_path).stem}"
+        count = 1
+        while name.lower() in taken:
+            count += 1
+            name = f"{base_name} ({count})"
+        taken.add(name.lower())
+        paths[input_path] = output_dir / name
+    return paths
+
+
+def run_directory(input_dir, reports, jobs=None, per_file=False,
+                  worker_memory_mb=None, use_cache=True, rebuild_cache=False,
+                  fmt="xlsx", lean=False, float_dtype="float64", store=None,
+                  envelope=None, stream_rows=None):
+    # Runs the reports over every CSV export in input_dir, in a pool of
+    # worker processes. Without per_file the force reports of all files are
+    # written to one report with a file column, otherwise each file gets its
+    # own report in report/. The files sheet lists the files that failed.
+    input_paths = sorted(str(path) for path in Path(input_dir).iterdir()
+                         if path.suffix.lower() == ".csv")
+    output_dir = Path("report")
+    outputs = dict.fromkeys(input_paths)
+    if per_file:
+        output_dir.mkdir(exist_ok=True)
+        outputs = report_paths(input_paths, output_dir)
+    process = partial(process_file, reports=reports,
+                      fmt=fmt, use_cache=use_cache, rebuild_cache=rebuild_cache,
+                      float_dtype=float_dtype, envelope=envelope,
+                      stream_rows=stream_rows)
+    if per_file:
+        process = partial(process, lean=lean)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    # Models held by the server are already parsed. In this process the
+    # stages of each file are recorded as they run.
+    if store is not None or (jobs <= 1 and worker_memory_mb is None):
+        results = {input_path: process(input_path, output=outputs[input_path],
+                                       store=store)
+                   for input_path in input_paths}
+    else:
+        max_bytes = worker_memory_mb * 1024 ** 2 if worker_memory_mb else None
+        with profiler.stage(f"Processing {len(input_paths)} files"):
+            results, broken = process_in_pool(
+                process, input_paths, outputs, jobs, max_bytes)
+            # A worker that died, e.g. killed for running out of memory,
+            # breaks the pool and every file still in it. Each of them runs
+            # again in a pool of its own to tell which one it was.
+            for input_path in broken:
+                result, died = process_in_pool(
+                    process, [input_path], outputs, 1, max_bytes)
+                results.update(result)
+                if died:
+                    results[input_path] = (
+                        None, "BrokenProcessPool: the worker process died, "
+                              "possibly out of memory")
+
+    files_df = pd.DataFrame([
+        {"file": Path(input_path).name, "status": "failed" if error else "ok",
+         "error": error}
+        for input_path, (_, error) in sorted(results.items())
+    ], columns=["file", "status", "error"])
+    for row in files_df[files_df["status"] == "failed"].itertuples():
+        print(f"Skipped {row.file}: {row.error}")
+
+    if per_file:
+        with profiler.stage("Writing report"):
+            write_report({"files": files_df}, output_dir / "files", fmt)
+        return
+
+    sheets = {}
+    sheet_names = dict.fromkeys(
+        sheet_name for sheets_by_file, _ in results.values()
+        if sheets_by_file is not None for sheet_name in sheets_by_file)
+    for sheet_name in sheet_names:
+        sheets[sheet_name] = pd.concat([
+            sheets_by_file[sheet_name].assign(file=Path(input_path).name)
+            for input_path, (sheets_by_file, _) in sorted(results.items())
+            if sheets_by_file is not None
+        ] or [pd.DataFrame()], ignore_index=True)
+        # The file column first
+        columns = list(sheets[sheet_name].columns)
+        if "file" in columns:
+            columns.remove("file")
+            sheets[sheet_name] = sheets[sheet_name][["file"] + columns]
+    sheets["files"] = files_df
+    with profiler.stage("Writing report"):
+        write_report(sheets, "report", fmt)
+
+
+def read_batch(batch, lc=None):
+    # batch is a file path or a literal list of (class_1, class_2) or
+    # (class_1, class_2, lc) entries, e.g. "[('HE800A', 'IPE600', [1, 2])]".
+    # Entries without load cases use lc.
+    if os.path.isfile(batch):
+        with open(batch) as f:
+            batch = f.read()
+
+    reports = {}
+    for entry in ast.literal_eval(batch):
+        class_1, class_2 = entry[0], entry[1]
+        if len(entry) > 2:
+            report_lc = [str(item) for item in entry[2]]
+        elif lc is not None:
+            report_lc = lc
+        else:
+            raise ValueError(
+                f"No load cases given for {class_1} and {class_2}, add them to the entry or pass --lc")
+
+        reports[unique_sheet_name(f"{class_1}-{class_2}", reports)] = (
+            class_1, class_2, report_lc)
+    return reports
+
+
+def unique_sheet_name(name, taken, suffix=""):
+    # Excel sheet names are limited to 31 characters and must be unique.
+    # name is cut short before suffix.
+    sheet_name = name[:31 - len(suffix)] + suffix
+    count = 1
+    while sheet_name in taken:
+        count += 1
+        number = f" ({count})"
+        sheet_name = name[:31 - len(suffix) - len(number)] + suffix + number
+    return sheet_name
+
+
+def main(argv=None, store=None):
+    parser = argparse.ArgumentParser(prog="script.py")
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument("--input_path",
                         type=str, help="Path of the input file")
-    parser.add_argument("--class_1", required=True,
+    inputs.add_argument("--input_dir", type=str,
+                        help="Directory of exports, every CSV file in it is processed")
+    parser.add_argument("--class_1",
                         type=str, help="First section name")
-    parser.add_argument("--class_2", required=True,
+    parser.add_argument("--class_2",
                         type=str, help="Second section name")
-    parser.add_argument("--lc", required=True, type=str,
+    parser.add_argument("--lc", type=str,
                         help="List of load cases, e.g. '[1, 2, 203]'")
-    args = parser.parse_args()
+    parser.add_argument("--batch", type=str,
+                        help="File or list of class pairs with optional load cases, "
+                             "e.g. \"[('HE800A', 'HE800A'), ('HE800A', 'IPE600', [203])]\"")
+    parser.add_argument("--no_cache", "--no-cache", action="store_true",
+                        help="Parse the input without reading or writing the cache")
+    parser.add_argument("--rebuild_cache", "--rebuild-cache", action="store_true",
+                        help="Parse the input again and replace its cache entry")
+    parser.add_argument("--format", choices=FORMATS, default="xlsx",
+                        help="report.xlsx, or one csv/parquet file per sheet in report/")
+    parser.add_argument("--lean", action="store_true",
+                        help="Only write the force reports, not the extracted tables")
+    parser.add_argument("--envelope", nargs="?", const="next", choices=["next", "only"],
+                        help="Add the max/min/abs max of every force with its load case "
+                             "per joint and per property, --envelope=only writes them "
+                             "instead of the force reports")
+    parser.add_argument("--float32", action="store_true",
+                        help="Keep forces and moments as float32 to halve their memory")
+    parser.add_argument("--stream", nargs="?", type=int, const=CHUNK_ROWS,
+                        metavar="ROWS",
+                        help="Read forces and reactions ROWS rows at a time and only keep "
+                             f"the forces at the joints (default {CHUNK_ROWS} rows), for "
+                             "exports larger than memory")
+    parser.add_argument("--profile", nargs="?", const="profile.json",
+                        help="Record time and memory of every stage, print a summary "
+                             "and save it as JSON (default profile.json)")
+    parser.add_argument("--cprofile", type=str,
+                        help="Save cProfile stats of the slowest stage to this path")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Number of files of --input_dir processed in parallel, "
+                             "defaults to the number of CPUs")
+    parser.add_argument("--per_file", "--per-file", action="store_true",
+                        help="With --input_dir, write one report per file into report/ "
+                             "instead of one consolidated report")
+    parser.add_argument("--worker_memory_mb", type=int, default=None,
+                        help="With --input_dir, heap limit of each worker process, a file "
+                             "that needs more fails instead")
+    parser.add_argument("--no_server", "--no-server", action="store_true",
+                        help="Run in this process even when server.py is running")
+    argv = sys.argv[1:] if argv is None else argv
+    args = parser.parse_args(argv)
+    if args.worker_memory_mb is not None and resource is None:
+        parser.error("--worker_memory_mb is not supported on this platform")
+
+    if args.profile or args.cprofile:
+        profiler.enable(use_cprofile=bool(args.cprofile))
     input_path = args.input_path
+    float_dtype = "float32" if args.float32 else "float64"
     class_1 = args.class_1
     class_2 = args.class_2
-    lc = [str(item) for item in ast.literal_eval(args.lc)]
-    run(input_path, class_1, class_2, lc)
+    lc = [str(item) for item in ast.literal_eval(args.lc)] if args.lc else None
+    if args.batch:
+        reports = read_batch(args.batch, lc)
+    else:
+        if class_1 is None or class_2 is None or lc is None:
+            parser.error("--class_1, --class_2 and --lc are required without --batch")
+        reports = {"final force report": (class_1, class_2, lc)}
+
+    if args.input_dir:
+        run_directory(args.input_dir, reports, jobs=args.jobs,
+                      per_file=args.per_file, worker_memory_mb=args.worker_memory_mb,
+                      use_cache=not args.no_cache, rebuild_cache=args.rebuild_cache,
+                      fmt=args.format, lean=args.lean, float_dtype=float_dtype,
+                      store=store, envelope=args.envelope, stream_rows=args.stream)
+    else:
+        run_batch(input_path, reports, use_cache=not args.no_cache,
+                  rebuild_cache=args.rebuild_cache, fmt=args.format,
+                  lean=args.lean, float_dtype=float_dtype, store=store,
+                  envelope=args.envelope, stream_rows=args.stream)
+    if profiler.enabled:
+        profiler.report(args.profile or "profile.json", args.cprofile)
+
+
+if __name__ == "__main__":
+    main()
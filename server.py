@@ -0,0 +1,269 @@
+import argparse
+import contextlib
+import hmac
+import http.client
+import io
+import json
+import os
+import secrets
+import sys
+import traceback
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# host:port the server listens on and the command line tools look for it at
+SERVER_ADDRESS = os.environ.get("FORCEREPORT_SERVER", "127.0.0.1:8765")
+SERVER_MEMORY_BYTES = int(os.environ.get(
+    "FORCEREPORT_SERVER_MEMORY_BYTES", 4 * 1024 ** 3))
+# Written by the server at start, readable by its user only. Requests have to
+# carry it, so other users and web pages cannot run the tools on the server.
+TOKEN_PATH = os.environ.get("FORCEREPORT_SERVER_TOKEN",
+                            os.path.join(os.path.expanduser("~"), ".forcereport-server-token"))
+LOCAL_HOSTS = {"127.0.0.1", "localhost", "[::1]"}
+# Seconds a command line tool waits for the server to accept its request
+CONNECT_TIMEOUT = 0.5
+
+
+class LoadCaseView:
+    # Tables of a model held by the server, restricted to the load cases in
+    # lc, with the same interface as the model
+    def __init__(self, model, lc=None):
+        self.model = model
+        self.lc = lc
+
+    def __getitem__(self, name):
+        from staad import LOAD_CASE_TABLES, select_load_cases
+
+        df = self.model[name]
+        if self.lc is not None and name in LOAD_CASE_TABLES:
+            df = select_load_cases(df, self.lc)
+        return df
+
+    @property
+    def index(self):
+        return self.model.index
+
+    def content_hash(self, names):
+        return self.model.content_hash(names)
+
+
+class ModelStore:
+    # Parsed models of every load case, kept between requests and dropped
+    # least recently used first once their tables take more than max_bytes.
+    # A model is parsed again when its file changes.
+    def __init__(self, max_bytes=SERVER_MEMORY_BYTES, use_cache=True):
+        self.max_bytes = max_bytes
+        self.use_cache = use_cache
+        self.models = OrderedDict()
+
+    def get(self, input_path, lc=None, float_dtype="float64", use_cache=True,
+            rebuild_cache=False):
+        from cache import load_export
+
+        input_path = os.path.abspath(input_path)
+        stat = os.stat(input_path)
+        key = (input_path, stat.st_size, stat.st_mtime_ns, float_dtype)
+        if rebuild_cache or key not in self.models:
+            # Older versions of the file are of no use anymore
+            for old_key in [k for k in self.models if k[0] == input_path]:
+                del self.models[old_key]
+            self.models[key] = load_export(
+                input_path, use_cache=self.use_cache and use_cache,
+                rebuild_cache=rebuild_cache, float_dtype=float_dtype)
+        self.models.move_to_end(key)
+        return LoadCaseView(self.models[key], lc)
+
+    def memory(self):
+        return {key: sum(int(df.memory_usage(deep=True).sum())
+                         for df in model.tables.values())
+                for key, model in self.models.items()}
+
+    def evict(self):
+        memory = self.memory()
+        total = sum(memory.values())
+        for key in list(self.models):
+            if total <= self.max_bytes:
+                break
+            total -= memory[key]
+            del self.models[key]
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        # A browser can send a text/plain POST to localhost without asking,
+        # not an application/json one
+        if self.headers.get_content_type() != "application/json":
+            self.send_json({"error": "Expected application/json"}, 415)
+            return
+        if not self.authorized():
+            return
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.send_json(self.server.run(request["entry"], request["argv"], request["cwd"]))
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        self.send_json({
+            "models": [{"path": key[0], "float_dtype": key[3], "bytes": size}
+                       for key, size in self.server.store.memory().items()],
+            "max_bytes": self.server.store.max_bytes,
+        })
+
+    def authorized(self):
+        # Other names for this address are how DNS rebinding gets a page in
+        host = self.headers.get("Host", "").rsplit(":", 1)[0]
+        token = self.headers.get("X-ForceReport-Token", "")
+        if host not in LOCAL_HOSTS:
+            self.send_json({"error": f"Unexpected host {host}"}, 403)
+            return False
+        if not hmac.compare_digest(token.encode(), self.server.token.encode()):
+            self.send_json({"error": "Missing or wrong token"}, 403)
+            return False
+        return True
+
+    def send_json(self, response, status=200):
+        body = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ModelServer(HTTPServer):
+    # Requests are handled one at a time in the working directory of the
+    # client, so relative paths and report outputs behave as in-process
+    def __init__(self, address, store, token):
+        super().__init__(address, RequestHandler)
+        self.store = store
+        self.token = token
+
+    def run(self, entry, argv, cwd):
+        # Imported here, the tools import this module for the client and
+        # it stays free of numpy and pandas
+        import query
+        import reaction
+        import script
+        from profiling import profiler
+
+        main = {"script": script.main, "reaction": reaction.main,
+                "query": query.main}[entry]
+        output = io.StringIO()
+        status = 0
+        previous_cwd = os.getcwd()
+        try:
+            os.chdir(cwd)
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                main(argv, store=self.store)
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            output.write(traceback.format_exc())
+            status = 1
+        finally:
+            os.chdir(previous_cwd)
+            profiler.enabled = False
+            profiler.records = []
+            profiler.cprofiles = {}
+            self.store.evict()
+        print(f"{entry} {' '.join(argv)} -> {status}")
+        return {"status": status, "output": output.getvalue()}
+
+
+def request(entry, argv, address=SERVER_ADDRESS):
+    # Runs a command line tool on the server and prints its output. Returns
+    # its exit status, or None when no server is listening.
+    try:
+        with open(TOKEN_PATH) as f:
+            token = f.read().strip()
+    except OSError:
+        return None
+    host, port = address.rsplit(":", 1)
+    connection = http.client.HTTPConnection(host, int(port), timeout=CONNECT_TIMEOUT)
+    try:
+        connection.connect()
+    except OSError:
+        return None
+    # Parsing a large export can take a while
+    connection.sock.settimeout(None)
+    try:
+        connection.request(
+            "POST", "/run",
+            headers={"Content-Type": "application/json", "X-ForceReport-Token": token},
+            body=json.dumps({"entry": entry, "argv": argv, "cwd": os.getcwd()}))
+        reply = connection.getresponse()
+        response = json.loads(reply.read())
+        if reply.status != 200:
+            # E.g. a token left behind by an earlier server
+            raise ValueError(response["error"])
+        output, status = response["output"], response["status"]
+    except (OSError, http.client.HTTPException, ValueError, KeyError, TypeError) as e:
+        # The server died during the request, or something else listens on
+        # its port. The tool runs here instead.
+        print(f"The server did not run the request ({type(e).__name__}: {e}), "
+              "running it here", file=sys.stderr)
+        return None
+    finally:
+        connection.close()
+    print(output, end="")
+    return status
+
+
+def forward(entry, local_flags=()):
+    # Called from the __main__ of a tool before it imports numpy, pandas
+    # and the parser: runs its command line on the server when one is
+    # listening and exits with its status. local_flags are flags the
+    # server cannot handle, such as reading the standard input.
+    argv = sys.argv[1:]
+    if any(flag in argv for flag in ("--no_server", "--no-server", *local_flags)):
+        return
+    status = request(entry, argv)
+    if status is not None:
+        sys.exit(status)
+
+
+def load_tables(input_path, lc=None, float_dtype="float64", use_cache=True,
+                rebuild_cache=False, store=None):
+    # Tables of an export restricted to the load cases in lc, from the
+    # models kept by the server when running there
+    if store is not None:
+        return store.get(input_path, lc, float_dtype, use_cache=use_cache,
+                         rebuild_cache=rebuild_cache)
+    from cache import load_export
+
+    return load_export(input_path, lc, use_cache=use_cache,
+                       rebuild_cache=rebuild_cache, float_dtype=float_dtype)
+
+
+def serve(address=SERVER_ADDRESS, max_bytes=SERVER_MEMORY_BYTES, use_cache=True):
+    host, port = address.rsplit(":", 1)
+    token = secrets.token_hex(32)
+    server = ModelServer((host, int(port)), ModelStore(max_bytes, use_cache), token)
+    # Created readable by this user only, before the token is written
+    fd = os.open(TOKEN_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.chmod(TOKEN_PATH, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+    print(f"Serving parsed models on {address}, up to {max_bytes / 1024 ** 2:.0f} MB")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(TOKEN_PATH)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--address", type=str, default=SERVER_ADDRESS,
+                        help="host:port to listen on, keep it on localhost")
+    parser.add_argument("--memory_mb", type=int, default=SERVER_MEMORY_BYTES // 1024 ** 2,
+                        help="Memory budget of the parsed models kept between requests")
+    parser.add_argument("--no_cache", "--no-cache", action="store_true",
+                        help="Parse exports without reading or writing the cache")
+    args = parser.parse_args()
+    serve(args.address, args.memory_mb * 1024 ** 2, use_cache=not args.no_cache)
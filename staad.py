@@ -0,0 +1,503 @@
+import hashlib
+import io
+import mmap
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from io import BytesIO, StringIO
+from profiling import profiler
+
+ENCODING = "iso-8859-1"
+PREAMBLE_LINES = 30
+
+# Table name -> (start keyword, keywords of the table that follows it)
+SECTION_KEYWORDS = {
+    "nodes": ("Nodes", ["Beams"]),
+    "beams": ("Beams", ["Supports", "Sections"]),
+    "sections": ("Sections", ["Supports", "STAAD.Pro"]),
+    "reactions": ("Reactions", ["Beam End Forces"]),
+    "beam_end_forces": ("Beam End Forces", ["Max Forces by Property"]),
+    "max_forces_by_property": ("Max Forces by Property", []),
+}
+
+FORCE_COLUMNS = ["fx", "fy", "fz", "mx", "my", "mz"]
+BEAM_END_FORCES_COLUMNS = ["beam_id", "node", "lc"] + FORCE_COLUMNS
+REACTIONS_COLUMNS = ["node", "lc"] + FORCE_COLUMNS
+
+NODES_DTYPES = {"node": "int64", "x": "float64", "y": "float64", "z": "float64"}
+BEAMS_DTYPES = {
+    "beam_id": "int64", "node_a": "int64", "node_b": "int64", "len": "float64",
+    "property_id": "int64", "beta": "float64",
+}
+SECTIONS_DTYPES = {
+    "property_id": "int64", "name": "str", "area": "float64", "iyy": "float64",
+    "izz": "float64", "j": "float64", "material": "str", "source": "str",
+}
+
+PARSE_STAGES = {
+    "nodes": "Parsing nodes",
+    "sections": "Parsing sections",
+    "beams": "Parsing beams",
+    "beam_end_forces": "Parsing forces",
+    "node_to_beam": "Parsing node to beam map",
+    "reactions": "Parsing reactions",
+}
+# Rows read_csv parses at a time when filling the arrays of a table
+CHUNK_ROWS = 500000
+# Bytes at the start of a table its header rows are looked for in when the
+# table is streamed
+HEAD_BYTES = 1024 ** 2
+# Tables filtered on the requested load cases
+LOAD_CASE_TABLES = ["beam_end_forces", "reactions"]
+# Tables the joints and the property of each node are derived from
+GEOMETRY_TABLES = ["nodes", "beams", "sections"]
+
+# Line numbers are 0-based file lines, byte offsets are absolute file offsets.
+# The end of a section is exclusive and points at the line of the next table.
+Section = namedtuple(
+    "Section", ["start_line", "end_line", "start_byte", "end_byte"])
+
+
+class SectionIndex:
+    # Byte ranges of the tables of a memory-mapped export. Tables are sliced
+    # straight out of the mapping, so the file is never read as a whole.
+    def __init__(self, path, data, sections):
+        self.path = path
+        self.data = data
+        self.sections = sections
+
+    @classmethod
+    def build(cls, path, section_keywords=SECTION_KEYWORDS):
+        with open(path, "rb") as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                data = b""
+
+        # Skip the preamble
+        body_start = 0
+        for _ in range(PREAMBLE_LINES):
+            newline = data.find(b"\n", body_start)
+            if newline == -1:
+                body_start = len(data)
+                break
+            body_start = newline + 1
+
+        def line_start(pos, lower_bound):
+            return max(data.rfind(b"\n", lower_bound, pos) + 1, lower_bound)
+
+        # A table starts at the first line holding its keyword and ends at
+        # the first later line holding a keyword of the next table
+        spans = {}
+        for name, (start, ends) in section_keywords.items():
+            pos = data.find(start.encode(ENCODING), body_start)
+            if pos == -1:
+                continue
+            start_byte = line_start(pos, body_start)
+            newline = data.find(b"\n", pos)
+            next_line = newline + 1 if newline != -1 else len(data)
+
+            end_positions = [data.find(k.encode(ENCODING), next_line) for k in ends]
+            end_positions = [p for p in end_positions if p != -1]
+            if end_positions:
+                end_byte = line_start(min(end_positions), next_line)
+            else:
+                end_byte = len(data)
+            spans[name] = (start_byte, end_byte)
+
+        # Line numbers, counting newlines between consecutive offsets
+        line_numbers = {0: 0}
+        offsets = sorted({offset for span in spans.values() for offset in span})
+        previous = 0
+        for offset in offsets:
+            line_numbers[offset] = line_numbers[previous] + count_newlines(
+                data, previous, offset)
+            previous = offset
+        if len(data) in line_numbers and data[-1:] not in (b"", b"\n"):
+            # The last line has no newline but is still a line
+            line_numbers[len(data)] += 1
+
+        sections = {
+            name: Section(line_numbers[start_byte], line_numbers[end_byte],
+                          start_byte, end_byte)
+            for name, (start_byte, end_byte) in spans.items()
+        }
+        return cls(path, data, sections)
+
+    def __contains__(self, name):
+        return name in self.sections
+
+    def read(self, name):
+        section = self.sections.get(name)
+        if section is None:
+            return b""
+        return self.data[section.start_byte:section.end_byte]
+
+    def head(self, name, size=HEAD_BYTES):
+        section = self.sections.get(name)
+        if section is None:
+            return b""
+        return self.data[section.start_byte:min(section.start_byte + size,
+                                                section.end_byte)]
+
+    def open(self, name):
+        # File object over a table, reading the map as it goes instead of
+        # copying the whole table like read
+        section = self.sections.get(name)
+        if section is None:
+            return BytesIO(b"")
+        return io.BufferedReader(
+            SectionReader(self.data, section.start_byte, section.end_byte))
+
+    def lines(self, name):
+        return self.read(name).decode(ENCODING).splitlines()
+
+
+class SectionReader(io.RawIOBase):
+    def __init__(self, data, start, end):
+        self.data = data
+        self.pos = start
+        self.end = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), self.end - self.pos)
+        buffer[:count] = self.data[self.pos:self.pos + count]
+        self.pos += count
+        return count
+
+
+def count_newlines(data, start, end, chunk_size=64 * 1024 ** 2):
+    count = 0
+    for chunk_start in range(start, end, chunk_size):
+        count += data[chunk_start:min(chunk_start + chunk_size, end)].count(b"\n")
+    return count
+
+
+def parse_table(table_lines, dtype=None):
+    table_str = "\n".join(table_lines)
+    if dtype is not None:
+        df = pd.read_csv(StringIO(table_str), header=None, dtype=dtype)
+    else:
+        df = pd.read_csv(StringIO(table_str), header=None, low_memory=False)
+    df = df.dropna(how='all', axis=0).dropna(how='all', axis=1)
+    return df
+
+
+def table_dtypes(columns, float_dtype="float64"):
+    # Compact schema of the force tables: int32 ids, load cases as a
+    # categorical of their labels and forces/moments as float_dtype
+    dtypes = {"beam_id": "int32", "node": "int32", "lc": "category"}
+    dtypes.update({column: float_dtype for column in FORCE_COLUMNS})
+    return {column: dtypes[column] for column in columns}
+
+
+def header_line_count(data, header_rows):
+    # Number of lines up to and including the last header row of a table
+    count = 0
+    pos = 0
+    while header_rows and pos < len(data):
+        end = data.find(b"\n", pos)
+        if end == -1:
+            end = len(data)
+        if data[pos:end].replace(b",", b"").strip():
+            header_rows -= 1
+        count += 1
+        pos = end + 1
+    return count
+
+
+def field_count(data, lines):
+    # Widest of the first lines of a table. Header rows are padded to the
+    # width of the table, and read_csv needs it up front.
+    count = 1
+    pos = 0
+    for _ in range(lines):
+        end = data.find(b"\n", pos)
+        if end == -1:
+            end = len(data)
+        count = max(count, data.count(b",", pos, end) + 1)
+        if end == len(data):
+            break
+        pos = end + 1
+    return count
+
+
+def array_dtype(dtype):
+    # Dtype of the array a column is collected in, categories as their codes
+    if dtype == "category":
+        return np.int32
+    if dtype == "str":
+        return object
+    return dtype
+
+
+def typed_chunks(data, header_rows, dtypes, key_column, fill_column=None,
+                 lc=None, chunk_rows=CHUNK_ROWS, labels=None, source=None):
+    # Parse a table chunk by chunk into the columns of dtypes, yielding the
+    # arrays of the rows kept in each chunk. The first field of every row is
+    # the title column and is skipped. Rows with a blank key_column are
+    # blank rows and dropped. Blank cells of fill_column take the value
+    # above them, also across chunks, before rows of load cases not in lc
+    # are dropped. Categories are yielded as codes into labels, shared by
+    # all chunks. Rows are read from source when given, data then only
+    # needs to hold the header rows and the first row.
+    columns = list(dtypes)
+    skiprows = header_line_count(data, header_rows)
+    if labels is None:
+        labels = {}
+
+    # Everything numeric is read as float64, where blank cells are NaN, and
+    # cast when copied into its array
+    width = max(field_count(data, skiprows + 1), len(columns) + 1)
+    names = ["title"] + columns + [f"extra_{i}" for i in range(width - len(columns) - 1)]
+    read_dtypes = {
+        column: dtype if dtype in ("category", "str") else "float64"
+        for column, dtype in dtypes.items()}
+    carry = np.nan
+    try:
+        chunks = pd.read_csv(
+            BytesIO(data) if source is None else source, header=None,
+            names=names, skiprows=skiprows,
+            usecols=columns, dtype=read_dtypes, encoding=ENCODING,
+            chunksize=chunk_rows)
+    except pd.errors.EmptyDataError:
+        chunks = []
+
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        values = {}
+        for column, dtype in dtypes.items():
+            if dtype == "category":
+                # Codes of the chunk mapped to codes over the whole table
+                codes = chunk[column].cat.codes.to_numpy()
+                lookup = np.array([labels.setdefault(label, len(labels))
+                                   for label in chunk[column].cat.categories] + [-1],
+                                  dtype=np.int32)
+                values[column] = lookup[codes]
+            else:
+                values[column] = chunk[column].to_numpy()
+
+        if fill_column is not None:
+            filled = values[fill_column]
+            rows = np.where(np.isnan(filled), -1, np.arange(len(filled)))
+            rows = np.maximum.accumulate(rows)
+            filled = np.where(rows >= 0, filled[np.maximum(rows, 0)], carry)
+            values[fill_column] = filled
+            carry = filled[-1]
+
+        key = values[key_column]
+        keep = key >= 0 if dtypes[key_column] == "category" else ~pd.isna(key)
+        if lc is not None:
+            wanted = [code for label, code in labels.items() if label in lc]
+            keep &= np.isin(values["lc"], wanted)
+        yield {column: values[column][keep] for column in columns}
+
+
+def typed_frame(arrays, dtypes, labels, lc=None):
+    for column, dtype in dtypes.items():
+        if dtype == "category":
+            # Categories in the sorted order read_csv gives them
+            categories = sorted(labels, key=labels.get)
+            order = sorted(range(len(categories)), key=categories.__getitem__)
+            remap = np.empty(len(categories), dtype=np.int32)
+            remap[order] = np.arange(len(categories), dtype=np.int32)
+            array = pd.Categorical.from_codes(
+                remap[arrays[column]], [categories[i] for i in order])
+            if lc is not None:
+                array = array.remove_unused_categories()
+            arrays[column] = array
+    return pd.DataFrame(arrays, copy=False)
+
+
+def parse_typed(index, name, header_rows, dtypes, key_column, fill_column=None,
+                lc=None, chunk_rows=CHUNK_ROWS):
+    # Parse a table of the export into the columns and dtypes of dtypes,
+    # copying the rows of each chunk into arrays allocated once for the
+    # whole table. The rows are read from the map as they are parsed, the
+    # table is never copied as a whole.
+    head = index.head(name)
+    skiprows = header_line_count(head, header_rows)
+    section = index.sections.get(name)
+    lines = section.end_line - section.start_line + 1 if section else 0
+    size = max(lines - skiprows, 0)
+    arrays = {column: np.empty(size, dtype=array_dtype(dtype))
+              for column, dtype in dtypes.items()}
+    labels = {}
+    pos = 0
+    for values in typed_chunks(head, header_rows, dtypes, key_column,
+                               fill_column, lc, chunk_rows, labels,
+                               source=index.open(name)):
+        count = len(values[key_column])
+        for column, array in arrays.items():
+            array[pos:pos + count] = values[column]
+        pos += count
+
+    if pos < size:
+        for array in arrays.values():
+            # Shrinks in place, without copying the rows kept
+            array.resize(pos, refcheck=False)
+    return typed_frame(arrays, dtypes, labels, lc)
+
+
+def stream_typed(index, name, header_rows, dtypes, key_column, fill_column=None,
+                 lc=None, keep=None, chunk_rows=CHUNK_ROWS):
+    # Parse a table of the export without holding it in memory, neither its
+    # bytes nor its rows. Only the rows of each chunk that keep (a function
+    # of the arrays of the chunk, returning a mask) accepts are collected.
+    labels = {}
+    parts = {column: [] for column in dtypes}
+    for values in typed_chunks(index.head(name), header_rows, dtypes, key_column,
+                               fill_column, lc, chunk_rows, labels,
+                               source=index.open(name)):
+        if keep is not None:
+            mask = keep(values)
+            values = {column: array[mask] for column, array in values.items()}
+        for column, array in values.items():
+            parts[column].append(array)
+
+    arrays = {
+        column: np.concatenate(parts[column] or [np.empty(0)]).astype(
+            array_dtype(dtype), copy=False)
+        for column, dtype in dtypes.items()}
+    return typed_frame(arrays, dtypes, labels, lc)
+
+
+def parse_nodes(index):
+    return parse_typed(index, "nodes", 3, NODES_DTYPES, key_column="node")
+
+
+def parse_sections(index):
+    return parse_typed(index, "sections", 3, SECTIONS_DTYPES,
+                       key_column="property_id")
+
+
+def parse_beams(index):
+    return parse_typed(index, "beams", 3, BEAMS_DTYPES, key_column="beam_id")
+
+
+def parse_beam_end_forces(index, lc=None, float_dtype="float64"):
+    # Forces of the requested load cases, all of them when lc is None
+    return parse_typed(
+        index, "beam_end_forces", 4,
+        table_dtypes(BEAM_END_FORCES_COLUMNS, float_dtype),
+        key_column="lc", fill_column="beam_id", lc=lc)
+
+
+def parse_node_to_beam(index, chunk_rows=CHUNK_ROWS):
+    # First beam_id listed for each node in the Beam End Forces table, read
+    # from the beam and node columns only, chunk by chunk
+    dtypes = {"beam_id": "float64", "node": "float64"}
+    frames = [
+        pd.DataFrame(values).drop_duplicates(subset=["node"], keep="first")
+        for values in typed_chunks(
+            index.head("beam_end_forces"), 4, dtypes, key_column="node",
+            fill_column="beam_id", chunk_rows=chunk_rows,
+            source=index.open("beam_end_forces"))]
+    if not frames:
+        return pd.DataFrame({"node": pd.Series(dtype="int32"),
+                             "beam_id": pd.Series(dtype="int32")})
+    df = pd.concat(frames).drop_duplicates(subset=["node"], keep="first")
+    return df[["node", "beam_id"]].astype("int32").reset_index(drop=True)
+
+
+def parse_reactions(index, lc=None, float_dtype="float64"):
+    return parse_typed(
+        index, "reactions", 4,
+        table_dtypes(REACTIONS_COLUMNS, float_dtype),
+        key_column="lc", fill_column="node", lc=lc)
+
+
+def stream_beam_end_forces(index, lc=None, float_dtype="float64", keep=None,
+                           chunk_rows=CHUNK_ROWS):
+    return stream_typed(
+        index, "beam_end_forces", 4,
+        table_dtypes(BEAM_END_FORCES_COLUMNS, float_dtype),
+        key_column="lc", fill_column="beam_id", lc=lc, keep=keep,
+        chunk_rows=chunk_rows)
+
+
+def stream_reactions(index, lc=None, float_dtype="float64", keep=None,
+                     chunk_rows=CHUNK_ROWS):
+    return stream_typed(
+        index, "reactions", 4, table_dtypes(REACTIONS_COLUMNS, float_dtype),
+        key_column="lc", fill_column="node", lc=lc, keep=keep,
+        chunk_rows=chunk_rows)
+
+
+def select_load_cases(df, lc):
+    # Same rows the parsers keep for lc, taken from a table of every load case
+    df = df[df["lc"].isin(lc)].reset_index(drop=True)
+    df["lc"] = df["lc"].cat.remove_unused_categories()
+    return df
+
+
+class ExportModel:
+    # Tables of an export, each parsed from its byte range the first time it
+    # is used. With lc, forces and reactions only keep those load cases.
+    def __init__(self, input_path, lc=None, float_dtype="float64"):
+        self.input_path = input_path
+        self.lc = lc
+        self.float_dtype = float_dtype
+        self.tables = {}
+        self.hashes = {}
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            with profiler.stage("Indexing tables"):
+                self._index = SectionIndex.build(self.input_path)
+        return self._index
+
+    def __getitem__(self, name):
+        if name not in self.tables:
+            self.tables[name] = self.load(name)
+        return self.tables[name]
+
+    def content_hash(self, names):
+        # Hash of the raw bytes of the tables in names
+        key = tuple(names)
+        if key not in self.hashes:
+            digest = hashlib.sha256()
+            for name in names:
+                digest.update(name.encode())
+                with self.index.open(name) as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(block)
+            self.hashes[key] = digest.hexdigest()
+        return self.hashes[key]
+
+    def load(self, name):
+        index = self.index
+        with profiler.stage(PARSE_STAGES[name]):
+            return self.parse(index, name, self.lc)
+
+    def stream(self, name, keep=None, chunk_rows=CHUNK_ROWS):
+        # Rows of the forces or reactions of the load cases of the model that
+        # keep accepts, read chunk by chunk without parsing, or caching, the
+        # whole table
+        index = self.index
+        stream = {"beam_end_forces": stream_beam_end_forces,
+                  "reactions": stream_reactions}[name]
+        with profiler.stage(f"Streaming {name}"):
+            return stream(index, self.lc, self.float_dtype, keep, chunk_rows)
+
+    def parse(self, index, name, lc=None):
+        if name == "nodes":
+            return parse_nodes(index)
+        if name == "sections":
+            return parse_sections(index)
+        if name == "beams":
+            return parse_beams(index)
+        if name == "beam_end_forces":
+            return parse_beam_end_forces(index, lc, self.float_dtype)
+        if name == "node_to_beam":
+            return parse_node_to_beam(index)
+        if name == "reactions":
+            return parse_reactions(index, lc, self.float_dtype)
+        raise KeyError(name)